@@ -13,6 +13,8 @@
 
 from __future__ import unicode_literals
 
+import threading
+
 from testinfra import backend
 
 __all__ = ["get_backend", "get_backends"]
@@ -20,17 +22,20 @@ __all__ = ["get_backend", "get_backends"]
 
 _BACKEND_CACHE = {}
 _BACKENDS_CACHE = {}
+_CACHE_LOCK = threading.Lock()
 
 
 def get_backend(hostspec, **kwargs):
     key = (hostspec, frozenset(kwargs.items()))
-    if key not in _BACKEND_CACHE:
-        _BACKEND_CACHE[key] = backend.get_backend(hostspec, **kwargs)
-    return _BACKEND_CACHE[key]
+    with _CACHE_LOCK:
+        if key not in _BACKEND_CACHE:
+            _BACKEND_CACHE[key] = backend.get_backend(hostspec, **kwargs)
+        return _BACKEND_CACHE[key]
 
 
 def get_backends(hosts, **kwargs):
     key = (frozenset(hosts), frozenset(kwargs.items()))
-    if key not in _BACKENDS_CACHE:
-        _BACKENDS_CACHE[key] = backend.get_backends(hosts, **kwargs)
-    return _BACKENDS_CACHE[key]
+    with _CACHE_LOCK:
+        if key not in _BACKENDS_CACHE:
+            _BACKENDS_CACHE[key] = backend.get_backends(hosts, **kwargs)
+        return _BACKENDS_CACHE[key]
@@ -16,6 +16,7 @@ from __future__ import unicode_literals
 from six.moves import urllib
 
 from testinfra.backend import ansible
+from testinfra.backend import asyncssh
 from testinfra.backend import docker
 from testinfra.backend import local
 from testinfra.backend import paramiko
@@ -30,6 +31,7 @@ BACKENDS = dict((klass.get_connection_type(), klass) for klass in (
     salt.SaltBackend,
     docker.DockerBackend,
     ansible.AnsibleBackend,
+    asyncssh.AsyncsshBackend,
 ))
 
 
@@ -49,9 +51,11 @@ def parse_hostspec(hostspec):
         query = urllib.parse.parse_qs(url.query)
         if query.get("sudo", ["false"])[0].lower() == "true":
             kw["sudo"] = True
+        if query.get("lazy", ["false"])[0].lower() == "true":
+            kw["lazy"] = True
         for key in (
             "ssh_config", "ansible_inventory",
-            "sudo_user",
+            "sudo_user", "timeout", "max_commands", "command_rate",
         ):
             if key in query:
                 kw[key] = query.get(key)[0]
@@ -16,6 +16,7 @@ from __future__ import absolute_import
 
 import logging
 import pprint
+import time
 
 from testinfra.backend import base
 
@@ -36,11 +37,16 @@ class AnsibleBackend(base.BaseBackend):
     def ansible_runner(self):
         if self._ansible_runner is None:
             from testinfra.utils.ansible_runner import AnsibleRunner
-            self._ansible_runner = AnsibleRunner(self.ansible_inventory)
+            with self._lock:
+                if self._ansible_runner is None:
+                    self._ansible_runner = AnsibleRunner(
+                        self.ansible_inventory)
         return self._ansible_runner
 
-    def run(self, command, *args):
-        command = self.get_command(command, *args)
+    def run(self, command, *args, **kwargs):
+        # Timeouts are only enforced on the host (see get_timeout_command)
+        command = self.get_command(
+            command, *args, timeout=self.get_timeout(kwargs))
         out = self.run_ansible("shell", module_args=command)
 
         # Ansible may return bytes as an unicode object...
@@ -65,9 +71,13 @@ class AnsibleBackend(base.BaseBackend):
         )
 
     def run_ansible(self, module_name, module_args=None, **kwargs):
-        result = self.ansible_runner.run(
-            self.host, module_name, module_args,
-            **kwargs)
+        with base.limits.command(self):
+            start = time.time()
+            result = self.ansible_runner.run(
+                self.host, module_name, module_args,
+                **kwargs)
+        self._record_command(
+            "%s(%s)" % (module_name, module_args), start)
         logger.info(
             "RUN Ansible(%s, %s, %s): %s",
             repr(module_name), repr(module_args), repr(kwargs),
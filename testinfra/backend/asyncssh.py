@@ -0,0 +1,64 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+from testinfra.backend import base
+
+
+class AsyncsshBackend(base.BaseBackend):
+    """Run commands using asyncssh (requires python >= 3.5)
+
+    Connections of all hosts are handled by a single event loop running in
+    a background thread and commands of a host are run in channels of the
+    same connection. Unlike paramiko (a thread per connection) or ssh (a
+    process per command) this scales to thousands of hosts.
+    """
+    NAME = "asyncssh"
+    # Maximum number of connections being established at the same time
+    # (shared by all hosts)
+    MAX_CONNECTING = 100
+    # Maximum number of concurrent channels on a connection, OpenSSH
+    # refuses more than 10 sessions by default (MaxSessions)
+    MAX_SESSIONS = 10
+
+    def __init__(self, hostspec, ssh_config=None, *args, **kwargs):
+        self.host, self.user, self.port = self.parse_hostspec(hostspec)
+        self.ssh_config = ssh_config
+        # future of (connection, sessions semaphore), created in the event
+        # loop thread
+        self._connection = None
+        super(AsyncsshBackend, self).__init__(self.host, *args, **kwargs)
+
+    def run(self, command, *args, **kwargs):
+        from testinfra.utils import aio
+        timeout = self.get_timeout(kwargs)
+        return aio.run_in_loop(aio.asyncssh_run(
+            self, self.get_command(command, *args, timeout=timeout),
+            timeout))
+
+    def arun(self, command, *args, **kwargs):
+        from testinfra.utils import aio
+        timeout = self.get_timeout(kwargs)
+        return aio.await_in_loop(aio.asyncssh_run(
+            self, self.get_command(command, *args, timeout=timeout),
+            timeout))
+
+    def close(self):
+        base.connections.discard(self)
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            from testinfra.utils import aio
+            # Don't wait, close() can be called from the event loop
+            aio.asyncssh_close(connection)
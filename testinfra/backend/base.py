@@ -13,23 +13,302 @@
 
 from __future__ import unicode_literals
 
+import base64
+import collections
+import contextlib
 import locale
 import logging
+import os
 import pipes
+import signal
 import subprocess
+import sys
+import threading
+import time
 
 import testinfra.modules
 
+try:
+    import contextvars
+except ImportError:  # python < 3.7
+    contextvars = None
+
 logger = logging.getLogger("testinfra")
 
+if contextvars is not None:
+    # id(backend) -> tuple of sudo users, follow threads and asyncio tasks
+    _SUDO_USERS = contextvars.ContextVar("testinfra_sudo_users", default={})
+
+# Callables notified of each command sent to a host with
+# (backend, command, duration, exit_status)
+command_listeners = []
+
+# Prefix of the lines giving results of commands run by run_many()
+BATCH_MARKER = "TESTINFRA_BATCH"
+# Maximum number of batches sent by BaseBackend.prefetch() and
+# BaseBackend.flush_deferred()
+MAX_PREFETCH_BATCHES = 5
+
+# Delay in seconds given to the client side timeout of a command before its
+# remote process is killed on the host
+TIMEOUT_GRACE = 5
+
+
+class ConnectionsLRU(object):
+    """Close least recently used connections above a maximum
+
+    Backends keeping a connection open run their commands in `use()`, idle
+    connections exceeding the maximum are closed with `backend.close()` and
+    reopened on the next command.
+    """
+
+    def __init__(self, maximum=None):
+        self.maximum = maximum
+        # id(backend) -> backend, least recently used first
+        self._backends = collections.OrderedDict()
+        # id(backend) -> number of running commands
+        self._users = {}
+        self._lock = threading.RLock()
+        super(ConnectionsLRU, self).__init__()
+
+    @contextlib.contextmanager
+    def use(self, backend):
+        key = id(backend)
+        with self._lock:
+            self._backends.pop(key, None)
+            self._backends[key] = backend
+            self._users[key] = self._users.get(key, 0) + 1
+            victims = self._get_victims()
+        # close() takes the lock of the backend, which may be held by a
+        # thread waiting for our lock
+        for victim in victims:
+            with self._lock:
+                if self._users.get(id(victim)):
+                    # used again meanwhile
+                    continue
+            logger.debug(
+                "Closing idle connection to %s", victim.get_pytest_id())
+            victim.close()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._users[key] -= 1
+
+    def _get_victims(self):
+        """Forget and return idle backends to close, least recently used
+        first"""
+        victims = []
+        if self.maximum is None:
+            return victims
+        excess = len(self._backends) - self.maximum
+        for key in list(self._backends):
+            if excess <= 0:
+                break
+            if not self._users.get(key):
+                victims.append(self._backends.pop(key))
+                self._users.pop(key, None)
+                excess -= 1
+        return victims
+
+    def discard(self, backend):
+        """Forget a closed connection"""
+        with self._lock:
+            self._backends.pop(id(backend), None)
+            if not self._users.get(id(backend)):
+                self._users.pop(id(backend), None)
+
+
+# Connections opened by all backends (see --testinfra-max-connections)
+connections = ConnectionsLRU()
+
+
+class TokenBucket(object):
+    """Allow `rate` events per second, with bursts of `burst` events"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1., rate)
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+        super(TokenBucket, self).__init__()
+
+    def reserve(self):
+        """Take a token and return the delay to wait before using it"""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.
+            return -self._tokens / self.rate
+
+
+class HostLimits(object):
+    """Limit commands sent to hosts and connections being established
+
+    Each host runs at most `max_commands` commands at the same time and
+    starts at most `command_rate` commands per second (see
+    BaseBackend.max_commands and BaseBackend.command_rate). Backends opening
+    their own connections establish at most `max_connecting` of them at the
+    same time, for all hosts.
+    """
+
+    def __init__(self, max_connecting=None):
+        # (hostname, max_commands, command_rate) -> (semaphore or None,
+        # TokenBucket or None), backends of a host may have other limits
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self.max_connecting = max_connecting
+        # hostname -> [number of queued commands, time spent waiting]
+        self.queued = {}
+        super(HostLimits, self).__init__()
+
+    @property
+    def max_connecting(self):
+        return self._max_connecting
+
+    @max_connecting.setter
+    def max_connecting(self, value):
+        self._max_connecting = value
+        self._connecting = (
+            threading.BoundedSemaphore(value) if value else None)
+
+    def _get_host(self, backend):
+        key = (
+            backend.get_hostname(), backend.max_commands,
+            backend.command_rate)
+        with self._lock:
+            if key not in self._hosts:
+                self._hosts[key] = (
+                    threading.BoundedSemaphore(backend.max_commands)
+                    if backend.max_commands else None,
+                    TokenBucket(backend.command_rate)
+                    if backend.command_rate else None)
+            return self._hosts[key]
+
+    def record(self, backend, queued):
+        """Account `queued` seconds spent waiting to run a command"""
+        if queued <= 0:
+            return
+        with self._lock:
+            stats = self.queued.setdefault(backend.get_hostname(), [0, 0.])
+            stats[0] += 1
+            stats[1] += queued
+        with backend._lock:
+            backend.queue_time += queued
+
+    def reserve(self, backend):
+        """Return the delay to wait before starting a command on the host"""
+        _, bucket = self._get_host(backend)
+        return bucket.reserve() if bucket is not None else 0.
+
+    def acquire(self, backend):
+        """Wait for a command slot of the host of `backend`"""
+        semaphore, bucket = self._get_host(backend)
+        if semaphore is None and bucket is None:
+            return
+        start = time.time()
+        # Only commands waiting for a slot are accounted as queued
+        blocked = False
+        if semaphore is not None and not semaphore.acquire(False):
+            blocked = True
+            semaphore.acquire()
+        delay = self.reserve(backend)
+        if delay:
+            blocked = True
+            time.sleep(delay)
+        if blocked:
+            self.record(backend, time.time() - start)
+
+    def release(self, backend):
+        semaphore, _ = self._get_host(backend)
+        if semaphore is not None:
+            semaphore.release()
+
+    @contextlib.contextmanager
+    def command(self, backend):
+        """Run a command of `backend` within the limits of its host"""
+        self.acquire(backend)
+        try:
+            yield
+        finally:
+            self.release(backend)
+
+    @contextlib.contextmanager
+    def connecting(self):
+        """Establish a connection within the global limit"""
+        semaphore = self._connecting
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+
+# Limits of all backends (see --testinfra-max-commands)
+limits = HostLimits()
+
+
+class Facts(object):
+    """Facts discovered on a host, shared by all tests of the session
+
+    Modules store there what they parse from the host (mount points,
+    statuses of services...) so it is discovered once, whatever the test
+    module asking for it. Facts are forgotten when a test runs a command
+    with Command(...) or Command.run(), tests changing the state of the
+    host by other means must invalidate the facts they change (see the
+    testinfra_invalidate marker).
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.RLock()
+        super(Facts, self).__init__()
+
+    def get(self, key, func, *args):
+        """Return the fact `key`, computed with func(*args) when unknown"""
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = func(*args)
+            return self._values[key]
+
+    def invalidate(self, *keys):
+        """Forget facts starting with one of `keys` (all facts by default)
+
+        Keys are strings or tuples starting with a string, e.g.
+        ``invalidate("supervisor")`` forgets ``("supervisor", "nginx")``.
+        """
+        with self._lock:
+            if not keys:
+                self._values.clear()
+                return
+            for key in list(self._values):
+                name = key[0] if isinstance(key, tuple) else key
+                if name in keys:
+                    del self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values
+
 
 class CommandResult(object):
 
     def __init__(
         self, backend, exit_status, command, stdout_bytes,
-        stderr_bytes, stdout=None, stderr=None,
+        stderr_bytes, stdout=None, stderr=None, timed_out=False,
     ):
         self.exit_status = exit_status
+        # True when the command was stopped by its timeout (exit_status is
+        # then None)
+        self.timed_out = timed_out
         self._stdout_bytes = stdout_bytes
         self._stderr_bytes = stderr_bytes
         self._stdout = stdout
@@ -69,12 +348,13 @@ class CommandResult(object):
     def __repr__(self):
         return (
             "CommandResult(command=%s, exit_status=%s, stdout=%s, "
-            "stderr=%s)"
+            "stderr=%s%s)"
         ) % (
             repr(self.command),
             self.exit_status,
             repr(self._stdout_bytes or self._stdout),
             repr(self._stderr_bytes or self._stderr),
+            ", timed_out=True" if self.timed_out else "",
         )
 
 
@@ -83,20 +363,51 @@ class BaseBackend(object):
     NAME = None
     HAS_RUN_SALT = False
     HAS_RUN_ANSIBLE = False
+    # Commands are run on another host, timeouts also kill them there
+    REMOTE = True
 
-    def __init__(self, hostname, sudo=False, sudo_user=None, *args, **kwargs):
+    def __init__(
+        self, hostname, sudo=False, sudo_user=None, timeout=None,
+        max_commands=None, command_rate=None, lazy=False, *args, **kwargs
+    ):
+        # Protect lazy initializations, backends can be shared by threads
+        self._lock = threading.RLock()
+        # Per thread state (see Sudo module and aevaluate())
+        self._local = threading.local()
         self._encoding = None
         self._module_cache = {}
+        # Facts discovered by modules (see Facts)
+        self.facts = Facts()
+        # command -> list of results not used yet (see prefetch_commands())
+        self._prefetched = {}
+        # Number of prefetched results used by modules
+        self.prefetched_used = 0
+        # Commands run by modules are appended when it's a list (see
+        # get_prefetched())
+        self.recorded_commands = None
         self.hostname = hostname
         self.sudo = sudo
         self.sudo_user = sudo_user
+        # Default timeout of commands in seconds (see get_timeout())
+        self.timeout = float(timeout) if timeout is not None else None
+        # Maximum number of concurrent commands and of commands started per
+        # second on the host (see HostLimits)
+        self.max_commands = int(max_commands) if max_commands else None
+        self.command_rate = float(command_rate) if command_rate else None
+        # Probes of modules return Deferred values (see defer())
+        self.lazy = lazy
+        # Timings used for reporting (see --nagios)
+        self.command_count = 0
+        self.command_time = 0.
+        self.connect_time = 0.
+        self.queue_time = 0.
         super(BaseBackend, self).__init__()
 
     @classmethod
     def get_connection_type(cls):
         """Return the connection backend used as string.
 
-        Can be local, paramiko, ssh, docker, salt or ansible
+        Can be local, paramiko, ssh, docker, salt, ansible or asyncssh
         """
         return cls.NAME
 
@@ -153,8 +464,64 @@ class BaseBackend(object):
             return self.quote(
                 "sudo -u %s /bin/sh -c %s", sudo_user, command)
 
-    def get_command(self, command, *args):
+    def _get_sudo_users(self):
+        if contextvars is not None:
+            return _SUDO_USERS.get().get(id(self), ())
+        return getattr(self._local, "sudo_users", ())
+
+    @contextlib.contextmanager
+    def sudo_context(self, user=None):
+        """Run commands of the current thread or asyncio task with sudo
+
+        See Sudo module
+        """
+        users = self._get_sudo_users() + (user,)
+        # Deferred values are evaluated with the user they were created with
+        self.flush_deferred()
+        if contextvars is not None:
+            mapping = dict(_SUDO_USERS.get())
+            mapping[id(self)] = users
+            token = _SUDO_USERS.set(mapping)
+            try:
+                yield
+            finally:
+                self.flush_deferred()
+                _SUDO_USERS.reset(token)
+        else:
+            self._local.sudo_users = users
+            try:
+                yield
+            finally:
+                self.flush_deferred()
+                self._local.sudo_users = users[:-1]
+
+    def get_timeout(self, kwargs):
+        """Return the timeout of a command run with `kwargs`
+
+        The `timeout` keyword argument of run() takes precedence over the
+        default timeout of the backend, None means no timeout.
+        """
+        timeout = kwargs.get("timeout", self.timeout)
+        return float(timeout) if timeout is not None else None
+
+    def get_timeout_command(self, command, timeout):
+        """Kill command on the host after timeout (if timeout(1) exists)
+
+        The client gives up at `timeout`, the remote process is killed a bit
+        later so it doesn't keep running on the host.
+        """
+        return self.quote("/bin/sh -c %s", self.quote(
+            "T=$(command -v timeout 2>/dev/null); "
+            "exec ${T:+$T -s KILL %s} /bin/sh -c %s",
+            "%g" % (timeout + TIMEOUT_GRACE,), command))
+
+    def get_command(self, command, *args, **kwargs):
         command = self.quote(command, *args)
+        timeout = kwargs.get("timeout")
+        if timeout is not None and self.REMOTE:
+            command = self.get_timeout_command(command, timeout)
+        for user in reversed(self._get_sudo_users()):
+            command = self.get_sudo_command(command, user)
         if self.sudo:
             command = self.get_sudo_command(command, self.sudo_user)
         return command
@@ -162,19 +529,309 @@ class BaseBackend(object):
     def run(self, command, *args, **kwargs):
         raise NotImplementedError
 
-    def run_local(self, command, *args):
+    def close(self):
+        """Close the connection to the host, reopened when needed"""
+
+    def get_batch_command(self, commands):
+        """Return a shell command running `commands` one after the other
+
+        Results are printed on a line per command with the exit status,
+        stdout and stderr encoded in base64.
+        """
+        lines = ["d=$(mktemp -d) || exit 1"]
+        for command in commands:
+            lines.append((
+                "/bin/sh -c %s </dev/null >$d/o 2>$d/e; echo \"%s;$?;"
+                "$(base64 <$d/o | tr -d '\\n');"
+                "$(base64 <$d/e | tr -d '\\n')\""
+            ) % (pipes.quote(command), BATCH_MARKER))
+        lines.append("rm -rf $d")
+        return self.quote("/bin/sh -c %s", "\n".join(lines))
+
+    def run_many(self, commands, **kwargs):
+        """Run commands in a single round trip to the host
+
+        `commands` are strings or tuples of (command, arg, ...) as given to
+        run(), their results are returned in the same order::
+
+            >>> backend.run_many(["uname -s", ("test -d %s", "/etc")])
+            [CommandResult(command=b'uname -s', exit_status=0, ...),
+             CommandResult(command=b'test -d /etc', exit_status=0, ...)]
+
+        Commands are run by a shell script on the host (requiring mktemp and
+        base64), they are run one by one when the script fails.
+        """
+        commands = [
+            self.quote(*c) if isinstance(c, (list, tuple)) else c
+            for c in commands]
+        if len(commands) < 2:
+            return [self.run(command, **kwargs) for command in commands]
+        out = self.run(self.get_batch_command(commands), **kwargs)
+        prefix = (BATCH_MARKER + ";").encode("ascii")
+        results = [
+            line.split(b";")[1:4] for line in out.stdout_bytes.splitlines()
+            if line.startswith(prefix)]
+        if out.rc != 0 or len(results) != len(commands):
+            logger.debug(
+                "Batch of %d commands failed, running them one by one: %s",
+                len(commands), out)
+            return [self.run(command, **kwargs) for command in commands]
+        return [
+            self.result(
+                int(rc), self.encode(command),
+                base64.b64decode(stdout), base64.b64decode(stderr))
+            for command, (rc, stdout, stderr) in zip(commands, results)]
+
+    def prefetch_commands(self, commands):
+        """Run commands with run_many() and keep their results
+
+        Each result is used once by the next run of the same command by a
+        module (see get_prefetched()).
+        """
+        results = self.run_many(commands)
+        with self._lock:
+            for command, out in zip(commands, results):
+                self._prefetched.setdefault(command, []).append(out)
+
+    @contextlib.contextmanager
+    def prefetch(self, *instances):
+        """Evaluate probes of module instances in batches of commands
+
+        Commands run by the properties listed in the `probes` of each module
+        instance are sent with run_many(), their results are then used by
+        the modules until the end of the block (in the current thread)::
+
+            with host.prefetch(
+                File("/etc/nginx/nginx.conf"), Package("nginx"),
+                Service("nginx"), Socket("tcp://0.0.0.0:80"),
+            ):
+                assert File("/etc/nginx/nginx.conf").mode == 0o644
+                assert Package("nginx").is_installed
+                [...]
+
+        See evaluate_probes() for the evaluation of properties.
+        """
+        results, _ = self.evaluate_probes([
+            (instance, name) for instance in instances
+            for name in instance.probes])
+        snapshot = dict(getattr(self._local, "snapshot", None) or {})
+        for (command, args), out in results.items():
+            snapshot[self.get_command(command, *args)] = out
+        previous, self._local.snapshot = (
+            getattr(self._local, "snapshot", None), snapshot)
+        try:
+            yield
+        finally:
+            # Results of outer blocks are stale too when cleared in the
+            # block (see clear_prefetched())
+            if self._local.snapshot is snapshot:
+                self._local.snapshot = previous
+
+    def evaluate_probes(self, probes):
+        """Evaluate properties of module instances in batches of commands
+
+        `probes` is a list of (instance, name). Properties are evaluated
+        without running commands (as with aevaluate()) until they need one,
+        needed commands are run with run_many() and properties evaluated
+        again, so properties depending on the result of a command take
+        another batch.
+
+        Return the results of commands {(command, args): result} and, for
+        each probe, its (value, exc_info) or None if it still needed
+        commands after MAX_PREFETCH_BATCHES batches.
+        """
+        from testinfra.modules.base import CommandNeeded
+        import pytest
+        results = {}
+        values = [None] * len(probes)
+        pending = list(range(len(probes)))
+        for _ in range(MAX_PREFETCH_BATCHES):
+            needed = []
+            waiting = []
+            for i in pending:
+                instance, name = probes[i]
+                self._local.results = results
+                try:
+                    values[i] = (getattr(instance, name), None)
+                except CommandNeeded as exc:
+                    if exc.args[:2] not in needed:
+                        needed.append(exc.args[:2])
+                    waiting.append(i)
+                except (Exception, pytest.fail.Exception):
+                    # Raised again when the property is used
+                    values[i] = (None, sys.exc_info())
+                finally:
+                    self._local.results = None
+            if not needed:
+                break
+            outs = self.run_many([(c,) + tuple(a) for c, a in needed])
+            results.update(zip(needed, outs))
+            pending = waiting
+        return results, values
+
+    def defer(self, instance, name, func):
+        """Return a Deferred value of the property `name` of a module instance
+
+        Used by modules of lazy backends: the value is evaluated when it is
+        used (bool(), comparisons, str()...), along with the values of the
+        current thread created before and not used yet (see
+        flush_deferred()). Values used as soon as they are created are
+        evaluated one by one. `func` returns the value when it cannot be
+        evaluated with the others.
+        """
+        from testinfra.modules.base import Deferred
+        deferred = Deferred(self, instance, name, func)
+        self._local.__dict__.setdefault("deferred", []).append(deferred)
+        return deferred
+
+    def flush_deferred(self):
+        """Evaluate pending Deferred values of the current thread
+
+        Commands of all values are run in batches with evaluate_probes().
+        Modules not reading the state of the host (Command) and sudo
+        contexts flush pending values first, so they are evaluated in the
+        state they were created in.
+        """
+        pending = getattr(self._local, "deferred", None)
+        if not pending:
+            return
+        self._local.deferred = []
+        _, values = self.evaluate_probes([
+            (deferred.instance, deferred.name) for deferred in pending])
+        for deferred, value in zip(pending, values):
+            if value is not None:
+                deferred.set(*value)
+
+    def discard_deferred(self):
+        """Forget pending Deferred values of the current thread, they are
+        evaluated one by one if they are used later"""
+        self._local.deferred = []
+
+    def get_prefetched(self, command, *args):
+        """Return the prefetched result of a command or None
+
+        Commands are also appended to recorded_commands, unless they are
+        run in a sudo context (see Sudo module) which isn't prefetched.
+        """
+        snapshot = getattr(self._local, "snapshot", None)
+        if snapshot:
+            out = snapshot.get(self.get_command(command, *args))
+            if out is not None:
+                return out
+        if self._get_sudo_users():
+            return None
+        command = self.quote(command, *args)
+        with self._lock:
+            if self.recorded_commands is not None and (
+                command not in self.recorded_commands
+            ):
+                self.recorded_commands.append(command)
+            results = self._prefetched.get(command)
+            if not results:
+                return None
+            out = results.pop(0)
+            if not results:
+                del self._prefetched[command]
+            self.prefetched_used += 1
+            return out
+
+    def clear_prefetched(self):
+        """Forget prefetched results, return the number of unused ones
+
+        Results of prefetch() blocks of the current thread are also
+        forgotten, modules then run their commands again.
+        """
+        if getattr(self._local, "snapshot", None):
+            self._local.snapshot = {}
+        with self._lock:
+            unused = sum(len(r) for r in self._prefetched.values())
+            self._prefetched.clear()
+        return unused
+
+    def arun(self, command, *args, **kwargs):
+        """Coroutine version of run() (requires python >= 3.5)
+
+        Backends running commands in a local process (local, ssh, safe-ssh
+        and docker) use asyncio subprocesses, others call run() in the event
+        loop executor.
+        """
+        from testinfra.utils import aio
+        return aio.run_in_executor(self.run, command, *args, **kwargs)
+
+    def aevaluate(self, func, *args, **kwargs):
+        """Coroutine returning func(*args, **kwargs)
+
+        Commands run by modules of this backend during the call are
+        awaited with arun() instead of blocking the event loop, so module
+        properties can be awaited:
+
+        >>> await backend.aevaluate(lambda: backend.Package("nginx").version)
+        '1.6.2'
+        """
+        from testinfra.utils import aio
+        return aio.evaluate(self, func, *args, **kwargs)
+
+    def arun_local(self, command, *args, **kwargs):
+        from testinfra.utils import aio
+        return aio.run_local(self, command, *args, **kwargs)
+
+    def run_local(self, command, *args, **kwargs):
+        """Run command in a local shell
+
+        With a `timeout` keyword argument, the process group of the shell is
+        killed when it expires and the result has timed_out set.
+        """
         command = self.quote(command, *args)
         command = self.encode(command)
+        with limits.command(self):
+            return self._run_local(command, kwargs.get("timeout"))
+
+    def _run_local(self, command, timeout):
+        start = time.time()
         p = subprocess.Popen(
             command, shell=True,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
+            preexec_fn=os.setsid if timeout is not None else None,
         )
-        stdout, stderr = p.communicate()
-        result = self.result(p.returncode, command, stdout, stderr)
+        timer = None
+        expired = []
+        if timeout is not None:
+            def kill():
+                expired.append(True)
+                try:
+                    os.killpg(p.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            timer = threading.Timer(timeout, kill)
+            timer.daemon = True
+            timer.start()
+        try:
+            stdout, stderr = p.communicate()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        rc = None if expired else p.returncode
+        self._record_command(command, start, rc)
+        result = self.result(
+            rc, command, stdout, stderr, timed_out=bool(expired))
         return result
 
+    def _set_command(self, command, out):
+        """Replace the command of a result run_local() with `command`"""
+        out.command = self.encode(command)
+        return out
+
+    def _record_command(self, command, start, exit_status=None):
+        """Account a command sent to the host and started at `start`"""
+        duration = time.time() - start
+        with self._lock:
+            self.command_count += 1
+            self.command_time += duration
+        for listener in command_listeners:
+            listener(self, command, duration, exit_status)
+
     @staticmethod
     def parse_hostspec(hostspec):
         host = hostspec
@@ -200,7 +857,9 @@ class BaseBackend(object):
     @property
     def encoding(self):
         if self._encoding is None:
-            self._encoding = self.get_encoding()
+            with self._lock:
+                if self._encoding is None:
+                    self._encoding = self.get_encoding()
         return self._encoding
 
     def decode(self, data):
@@ -237,8 +896,11 @@ class BaseBackend(object):
 
         """
         try:
-            module = self._module_cache[name]
+            return self._module_cache[name]
         except KeyError:
-            module = getattr(testinfra.modules, name).get_module(self)
-            self._module_cache[name] = module
-        return module
+            pass
+        with self._lock:
+            if name not in self._module_cache:
+                self._module_cache[name] = getattr(
+                    testinfra.modules, name).get_module(self)
+            return self._module_cache[name]
@@ -14,6 +14,8 @@
 from __future__ import unicode_literals
 from __future__ import absolute_import
 
+import functools
+
 from testinfra.backend import base
 
 
@@ -28,14 +30,25 @@ class DockerBackend(base.BaseBackend):
             self.user = None
         super(DockerBackend, self).__init__(self.name, *args, **kwargs)
 
-    def run(self, command, *args, **kwargs):
-        cmd = self.get_command(command, *args)
+    def _get_docker_command(self, cmd):
         if self.user is not None:
-            out = self.run_local(
+            return [
                 "docker exec -u %s %s /bin/sh -c %s",
-                self.user, self.name, cmd)
+                self.user, self.name, cmd]
         else:
-            out = self.run_local(
-                "docker exec %s /bin/sh -c %s", self.name, cmd)
-        out.command = self.encode(cmd)
-        return out
+            return ["docker exec %s /bin/sh -c %s", self.name, cmd]
+
+    def run(self, command, *args, **kwargs):
+        timeout = self.get_timeout(kwargs)
+        cmd = self.get_command(command, *args, timeout=timeout)
+        out = self.run_local(*self._get_docker_command(cmd), timeout=timeout)
+        return self._set_command(cmd, out)
+
+    def arun(self, command, *args, **kwargs):
+        from testinfra.utils import aio
+        timeout = self.get_timeout(kwargs)
+        cmd = self.get_command(command, *args, timeout=timeout)
+        return aio.then(
+            self.arun_local(
+                *self._get_docker_command(cmd), timeout=timeout),
+            functools.partial(self._set_command, cmd))
@@ -18,6 +18,7 @@ from testinfra.backend import base
 
 class LocalBackend(base.BaseBackend):
     NAME = "local"
+    REMOTE = False
 
     def __init__(self, *args, **kwargs):
         super(LocalBackend, self).__init__("local", **kwargs)
@@ -30,4 +31,11 @@ class LocalBackend(base.BaseBackend):
         return [host]
 
     def run(self, command, *args, **kwargs):
-        return self.run_local(self.get_command(command, *args))
+        return self.run_local(
+            self.get_command(command, *args),
+            timeout=self.get_timeout(kwargs))
+
+    def arun(self, command, *args, **kwargs):
+        return self.arun_local(
+            self.get_command(command, *args),
+            timeout=self.get_timeout(kwargs))
@@ -15,6 +15,7 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 
 import os
+import time
 
 try:
     import paramiko
@@ -44,57 +45,83 @@ class ParamikoBackend(base.BaseBackend):
     @property
     def client(self):
         if self._client is None:
-            if not HAS_PARAMIKO:
-                raise RuntimeError((
-                    "You must install paramiko package (pip install paramiko) "
-                    "to use the paramiko backend"))
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.WarningPolicy())
-            cfg = {
-                "hostname": self.host,
-                "port": int(self.port) if self.port else 22,
-                "username": self.user,
-            }
-            if self.ssh_config:
-                ssh_config = paramiko.SSHConfig()
-                with open(os.path.expanduser(self.ssh_config)) as f:
-                    ssh_config.parse(f)
-
-                for key, value in ssh_config.lookup(self.host).items():
-                    if key == "hostname":
-                        cfg[key] = value
-                    elif key == "user":
-                        cfg["username"] = value
-                    elif key == "port":
-                        cfg[key] = int(value)
-                    elif key == "identityfile":
-                        cfg["key_filename"] = os.path.expanduser(value[0])
-                    elif key == "stricthostkeychecking" and value == "no":
-                        client.set_missing_host_key_policy(IgnorePolicy())
+            with self._lock:
+                if self._client is None:
+                    self._client = self._connect()
+        return self._client
+
+    def _connect(self):
+        if not HAS_PARAMIKO:
+            raise RuntimeError((
+                "You must install paramiko package (pip install paramiko) "
+                "to use the paramiko backend"))
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.WarningPolicy())
+        cfg = {
+            "hostname": self.host,
+            "port": int(self.port) if self.port else 22,
+            "username": self.user,
+        }
+        if self.ssh_config:
+            ssh_config = paramiko.SSHConfig()
+            with open(os.path.expanduser(self.ssh_config)) as f:
+                ssh_config.parse(f)
 
+            for key, value in ssh_config.lookup(self.host).items():
+                if key == "hostname":
+                    cfg[key] = value
+                elif key == "user":
+                    cfg["username"] = value
+                elif key == "port":
+                    cfg[key] = int(value)
+                elif key == "identityfile":
+                    cfg["key_filename"] = os.path.expanduser(value[0])
+                elif key == "stricthostkeychecking" and value == "no":
+                    client.set_missing_host_key_policy(IgnorePolicy())
+
+        with base.limits.connecting():
+            start = time.time()
             client.connect(**cfg)
-            self._client = client
-        return self._client
+            self.connect_time += time.time() - start
+        return client
 
-    def _exec_command(self, command):
+    def close(self):
+        base.connections.discard(self)
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def _exec_command(self, command, timeout=None):
         chan = self.client.get_transport().open_session()
+        start = time.time()
         chan.exec_command(command)
+        if timeout is not None and not chan.status_event.wait(timeout):
+            chan.close()
+            self._record_command(command, start, None)
+            return None, b"", b""
         rc = chan.recv_exit_status()
         stdout = b''.join(chan.makefile('rb'))
         stderr = b''.join(chan.makefile_stderr('rb'))
+        self._record_command(command, start, rc)
         return rc, stdout, stderr
 
     def run(self, command, *args, **kwargs):
-        command = self.get_command(command, *args)
+        timeout = self.get_timeout(kwargs)
+        command = self.get_command(command, *args, timeout=timeout)
         command = self.encode(command)
-        try:
-            rc, stdout, stderr = self._exec_command(command)
-        except paramiko.ssh_exception.SSHException:
-            if not self.client.get_transport().is_active():
-                # try to reinit connection (once)
-                self._client = None
-                rc, stdout, stderr = self._exec_command(command)
-            else:
-                raise
+        with base.connections.use(self), base.limits.command(self):
+            try:
+                rc, stdout, stderr = self._exec_command(command, timeout)
+            except paramiko.ssh_exception.SSHException:
+                if not self.client.get_transport().is_active():
+                    # try to reinit connection (once)
+                    with self._lock:
+                        if not self.client.get_transport().is_active():
+                            self._client = None
+                    rc, stdout, stderr = self._exec_command(command, timeout)
+                else:
+                    raise
 
-        return self.result(rc, command, stdout, stderr)
+        return self.result(
+            rc, command, stdout, stderr, timed_out=rc is None)
@@ -14,6 +14,8 @@
 from __future__ import unicode_literals
 from __future__ import absolute_import
 
+import time
+
 try:
     import salt.client
 except ImportError:
@@ -43,17 +45,24 @@ class SaltBackend(base.BaseBackend):
     def client(self):
         if self._client is None:
             self._check_salt()
-            self._client = salt.client.LocalClient()
+            with self._lock:
+                if self._client is None:
+                    self._client = salt.client.LocalClient()
         return self._client
 
-    def run(self, command, *args):
-        command = self.get_command(command, *args)
+    def run(self, command, *args, **kwargs):
+        # Timeouts are only enforced on the minion (see get_timeout_command)
+        command = self.get_command(
+            command, *args, timeout=self.get_timeout(kwargs))
         out = self.run_salt("cmd.run_all", [command])
         return self.result(out['retcode'], command, out['stdout'],
                            out['stderr'])
 
     def run_salt(self, func, args=None):
-        out = self.client.cmd(self.host, func, args or [])
+        with base.limits.command(self):
+            start = time.time()
+            out = self.client.cmd(self.host, func, args or [])
+        self._record_command("%s(%s)" % (func, args), start)
         if self.host not in out:
             raise RuntimeError(
                 "Error while running %s(%s): %s. Minion not connected ?" % (
@@ -14,6 +14,7 @@
 from __future__ import unicode_literals
 
 import base64
+import functools
 
 from testinfra.backend import base
 
@@ -28,9 +29,16 @@ class SshBackend(base.BaseBackend):
         super(SshBackend, self).__init__(self.host, *args, **kwargs)
 
     def run(self, command, *args, **kwargs):
-        return self.run_ssh(self.get_command(command, *args))
+        timeout = self.get_timeout(kwargs)
+        return self.run_ssh(
+            self.get_command(command, *args, timeout=timeout), timeout)
 
-    def run_ssh(self, command):
+    def arun(self, command, *args, **kwargs):
+        timeout = self.get_timeout(kwargs)
+        return self.arun_ssh(
+            self.get_command(command, *args, timeout=timeout), timeout)
+
+    def _get_ssh_command(self, command):
         cmd = ["ssh"]
         cmd_args = []
         if self.ssh_config:
@@ -44,10 +52,19 @@ class SshBackend(base.BaseBackend):
             cmd_args.append(self.port)
         cmd.append("%s %s")
         cmd_args.extend([self.host, command])
+        return [" ".join(cmd)] + cmd_args
+
+    def run_ssh(self, command, timeout=None):
         out = self.run_local(
-            " ".join(cmd), *cmd_args)
-        out.command = self.encode(command)
-        return out
+            *self._get_ssh_command(command), timeout=timeout)
+        return self._set_command(command, out)
+
+    def arun_ssh(self, command, timeout=None):
+        from testinfra.utils import aio
+        return aio.then(
+            self.arun_local(
+                *self._get_ssh_command(command), timeout=timeout),
+            functools.partial(self._set_command, command))
 
 
 class SafeSshBackend(SshBackend):
@@ -67,13 +84,29 @@ class SafeSshBackend(SshBackend):
     NAME = "safe-ssh"
 
     def run(self, command, *args, **kwargs):
-        orig_command = self.get_command(command, *args)
-
-        out = self.run_ssh((
+        timeout = self.get_timeout(kwargs)
+        orig_command = self.get_command(command, *args, timeout=timeout)
+        out = self.run_ssh(self._wrap_command(orig_command), timeout)
+        return self._parse_output(orig_command, out)
+
+    def arun(self, command, *args, **kwargs):
+        from testinfra.utils import aio
+        timeout = self.get_timeout(kwargs)
+        orig_command = self.get_command(command, *args, timeout=timeout)
+        return aio.then(
+            self.arun_ssh(self._wrap_command(orig_command), timeout),
+            functools.partial(self._parse_output, orig_command))
+
+    @staticmethod
+    def _wrap_command(command):
+        return (
             '''of=$(mktemp)&&ef=$(mktemp)&&%s >$of 2>$ef; r=$?;'''
             '''echo "TESTINFRA_START;$r;$(base64 < $of);$(base64 < $ef);'''
-            '''TESTINFRA_END";rm -f $of $ef''') % (orig_command,))
+            '''TESTINFRA_END";rm -f $of $ef''') % (command,)
 
+    def _parse_output(self, orig_command, out):
+        if out.timed_out:
+            return self._set_command(orig_command, out)
         start = out.stdout.find("TESTINFRA_START;") + len("TESTINFRA_START;")
         end = out.stdout.find("TESTINFRA_END") - 1
         rc, stdout, stderr = out.stdout[start:end].split(";")
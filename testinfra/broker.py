@@ -0,0 +1,326 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Share connections and facts of hosts between processes
+
+A broker process owns the backends and run commands sent by clients (e.g.
+pytest-xdist workers) over a unix socket, so each host get a single
+connection and facts (encoding, SystemInfo) are discovered only once:
+
+    $ testinfra -n 16 --testinfra-broker --hosts=server1,server2
+
+Requests and responses are JSON documents, one per line.
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import base64
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from six.moves import socketserver
+
+import testinfra.backend
+from testinfra.backend import base
+
+logger = logging.getLogger("testinfra")
+
+# Environment variable giving the broker socket to workers
+BROKER_ENV = "TESTINFRA_BROKER"
+# Backend methods which can be called through the broker
+CALLS = ("run_salt", "run_ansible", "get_variables")
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn,
+                           socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in iter(self.rfile.readline, b""):
+            request = json.loads(line.decode("utf-8"))
+            try:
+                response = {"result": self.server.broker.handle(request)}
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.exception("Broker request %s failed", request)
+                response = {"error": "%s: %s" % (type(exc).__name__, exc)}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class Broker(object):
+    """Serve requests of BrokerClient on a unix socket"""
+
+    def __init__(self, path):
+        self.path = path
+        # key -> backend, sudo is handled by clients
+        self.backends = {}
+        self._lock = threading.Lock()
+        self.server = _ThreadingUnixServer(path, _Handler)
+        self.server.broker = self
+        super(Broker, self).__init__()
+
+    def get_backends(self, hosts, kwargs):
+        options = sorted(
+            (k, v) for k, v in kwargs.items()
+            if k not in ("sudo", "sudo_user"))
+        backends = []
+        for backend in testinfra.backend.get_backends(hosts, **kwargs):
+            pytest_id = backend.get_pytest_id()
+            key = json.dumps([pytest_id, options])
+            backends.append({
+                "key": key,
+                "pytest_id": pytest_id,
+                "connection": backend.get_connection_type(),
+                "hostname": backend.get_hostname(),
+                "sudo": backend.sudo,
+                "sudo_user": backend.sudo_user,
+                "timeout": backend.timeout,
+                # Limits are also applied by the backend of the broker
+                "max_commands": backend.max_commands,
+                "command_rate": backend.command_rate,
+                "lazy": backend.lazy,
+                "has_run_salt": backend.HAS_RUN_SALT,
+                "has_run_ansible": backend.HAS_RUN_ANSIBLE,
+            })
+            with self._lock:
+                if key not in self.backends:
+                    backend.sudo = False
+                    backend.sudo_user = None
+                    self.backends[key] = backend
+        return backends
+
+    def handle(self, request):
+        op = request["op"]
+        if op == "backends":
+            return self.get_backends(request["hosts"], request["kwargs"])
+        backend = self.backends[request["key"]]
+        if op == "run":
+            out = backend.run(request["command"], timeout=request["timeout"])
+            return {
+                "exit_status": out.exit_status,
+                "timed_out": out.timed_out,
+                "stdout": base64.b64encode(out.stdout_bytes).decode("ascii"),
+                "stderr": base64.b64encode(out.stderr_bytes).decode("ascii"),
+            }
+        elif op == "encoding":
+            return backend.encoding
+        elif op == "sysinfo":
+            return backend.get_module("SystemInfo").sysinfo
+        elif op == "call" and request["method"] in CALLS:
+            return getattr(backend, request["method"])(
+                *request["args"], **request["kwargs"])
+        raise RuntimeError("Invalid request '%s'" % (op,))
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+class BrokerClient(object):
+    """Send requests to a broker, with a connection per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        super(BrokerClient, self).__init__()
+
+    def _get_file(self):
+        f = getattr(self._local, "file", None)
+        if f is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            f = self._local.file = sock.makefile("rwb")
+            sock.close()
+        return f
+
+    def request(self, op, **kwargs):
+        kwargs["op"] = op
+        f = self._get_file()
+        f.write(json.dumps(kwargs).encode("utf-8") + b"\n")
+        f.flush()
+        line = f.readline()
+        if not line:
+            self._local.file = None
+            raise RuntimeError("Connection to testinfra broker lost")
+        response = json.loads(line.decode("utf-8"))
+        if "error" in response:
+            raise RuntimeError("testinfra broker: %s" % (response["error"],))
+        return response["result"]
+
+    def get_backends(self, hosts, **kwargs):
+        return [
+            BrokerBackend(self, **backend) for backend in self.request(
+                "backends", hosts=list(hosts), kwargs=kwargs)]
+
+
+class BrokerBackend(base.BaseBackend):
+    """Run commands of a host through a broker
+
+    The connection type, hostname and pytest id are those of the backend in
+    the broker process. Sudo is applied locally so the broker can share the
+    connection between backends with different sudo settings.
+    """
+    # Timeouts are enforced by the backend of the broker
+    REMOTE = False
+
+    def __init__(
+        self, client, key, pytest_id, connection, hostname,
+        has_run_salt=False, has_run_ansible=False, *args, **kwargs
+    ):
+        self.client = client
+        self.key = key
+        self.pytest_id = pytest_id
+        self.connection = connection
+        self.HAS_RUN_SALT = has_run_salt
+        self.HAS_RUN_ANSIBLE = has_run_ansible
+        super(BrokerBackend, self).__init__(hostname, *args, **kwargs)
+
+    def get_connection_type(self):
+        return self.connection
+
+    def get_pytest_id(self):
+        return self.pytest_id
+
+    def _request(self, op, **kwargs):
+        return self.client.request(op, key=self.key, **kwargs)
+
+    def get_encoding(self):
+        return self._request("encoding")
+
+    def run(self, command, *args, **kwargs):
+        command = self.get_command(command, *args)
+        start = time.time()
+        out = self._request(
+            "run", command=command, timeout=self.get_timeout(kwargs))
+        command = self.encode(command)
+        self._record_command(command, start, out["exit_status"])
+        return self.result(
+            out["exit_status"], command,
+            base64.b64decode(out["stdout"]), base64.b64decode(out["stderr"]),
+            timed_out=out["timed_out"])
+
+    def _call(self, method, *args, **kwargs):
+        return self._request("call", method=method, args=args, kwargs=kwargs)
+
+    def run_salt(self, func, args=None):
+        return self._call("run_salt", func, args)
+
+    def run_ansible(self, module_name, module_args=None, **kwargs):
+        return self._call("run_ansible", module_name, module_args, **kwargs)
+
+    def get_variables(self):
+        return self._call("get_variables")
+
+    def get_module(self, name):
+        module = super(BrokerBackend, self).get_module(name)
+        if name == "SystemInfo" and module._sysinfo is None:
+            with module._lock:
+                if module._sysinfo is None:
+                    module._sysinfo = self._request("sysinfo")
+        return module
+
+
+_CLIENTS = {}
+_BACKENDS_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def get_backends(path, hosts, **kwargs):
+    """Same as testinfra.get_backends() with backends of the broker"""
+    key = (path, frozenset(hosts), frozenset(kwargs.items()))
+    with _CACHE_LOCK:
+        if key not in _BACKENDS_CACHE:
+            if path not in _CLIENTS:
+                _CLIENTS[path] = BrokerClient(path)
+            _BACKENDS_CACHE[key] = _CLIENTS[path].get_backends(
+                hosts, **kwargs)
+        return _BACKENDS_CACHE[key]
+
+
+class BrokerProcess(object):
+    """pytest plugin running a broker during the session
+
+    The socket is given to pytest-xdist workers in the environment.
+    """
+
+    def __init__(self):
+        self.tmpdir = None
+        self.process = None
+        super(BrokerProcess, self).__init__()
+
+    def start(self, timeout=10):
+        self.tmpdir = tempfile.mkdtemp(prefix="testinfra-broker-")
+        path = os.path.join(self.tmpdir, "broker.sock")
+        # The broker exits when its stdin is closed
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "testinfra.broker", path],
+            stdin=subprocess.PIPE)
+        deadline = time.time() + timeout
+        while not os.path.exists(path):
+            if self.process.poll() is not None or time.time() > deadline:
+                self.stop()
+                raise RuntimeError("Cannot start testinfra broker")
+            time.sleep(.05)
+        os.environ[BROKER_ENV] = path
+
+    def stop(self):
+        os.environ.pop(BROKER_ENV, None)
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
+
+    def pytest_unconfigure(self):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run a testinfra broker until stdin is closed")
+    parser.add_argument("path", help="Path of the unix socket")
+    args = parser.parse_args(argv)
+    broker = Broker(args.path)
+
+    def wait_stdin():
+        for _ in iter(lambda: sys.stdin.read(4096), ""):
+            pass
+        broker.shutdown()
+
+    thread = threading.Thread(target=wait_stdin)
+    thread.daemon = True
+    thread.start()
+    broker.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
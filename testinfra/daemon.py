@@ -0,0 +1,227 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Run collected tests periodically and serve the latest results
+
+Backends (and so connections and cached facts) are kept in the process
+between runs. The results are served either on a unix socket or over HTTP:
+
+    $ testinfra -q --daemon --daemon-listen unix:///run/testinfra.sock
+    $ testinfra --daemon-query unix:///run/testinfra.sock
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import pytest
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves import urllib
+
+from testinfra.main import NagiosReporter
+from testinfra.plugin import get_item_backend
+
+logger = logging.getLogger("testinfra")
+
+UNKNOWN = 3
+# Consider the results as stale after this number of missed runs
+STALE_INTERVALS = 3
+
+
+def parse_address(address):
+    """Return ("unix", path) or ("http", (host, port)) from an address
+
+    >>> parse_address("unix:///run/testinfra.sock")
+    ('unix', '/run/testinfra.sock')
+    >>> parse_address("http://127.0.0.1:8080")
+    ('http', ('127.0.0.1', 8080))
+    """
+    if address.startswith("/"):
+        return "unix", address
+    url = urllib.parse.urlparse(address)
+    if url.scheme == "unix":
+        return "unix", url.netloc + url.path
+    elif url.scheme == "http":
+        return "http", (url.hostname or "127.0.0.1", url.port or 80)
+    raise RuntimeError("Invalid daemon address '%s'" % (address,))
+
+
+def _unknown(message):
+    return {
+        "code": UNKNOWN,
+        "output": "TESTINFRA UNKNOWN - %s\n" % (message,),
+        "time": None,
+    }
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn,
+                           socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def _make_unix_handler(daemon):
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            self.wfile.write(
+                json.dumps(daemon.get_result()).encode("utf-8"))
+
+    return Handler
+
+
+def _make_http_handler(daemon):
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            result = daemon.get_result()
+            if self.path == "/json":
+                content_type = "application/json"
+                body = json.dumps(result)
+            elif self.path == "/":
+                content_type = "text/plain; charset=utf-8"
+                body = result["output"]
+            else:
+                self.send_error(404)
+                return
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            logger.debug(*args)
+
+    return Handler
+
+
+class Daemon(object):
+    """pytest plugin running the collected tests in a loop"""
+
+    def __init__(self, config):
+        self.config = config
+        self.interval = config.option.daemon_interval
+        self.address = config.option.daemon_listen
+        self.reporter = NagiosReporter()
+        self.server = None
+        self._result = _unknown("no results yet")
+        super(Daemon, self).__init__()
+
+    def get_result(self):
+        result = self._result
+        if result["time"] is not None and (
+            time.time() - result["time"] > STALE_INTERVALS * self.interval
+        ):
+            return _unknown("results are stale, last run at %s" % (
+                time.ctime(result["time"]),))
+        return result
+
+    def start_server(self):
+        kind, address = parse_address(self.address)
+        if kind == "unix":
+            if os.path.exists(address):
+                os.unlink(address)
+            self.server = _ThreadingUnixServer(
+                address, _make_unix_handler(self))
+        else:
+            self.server = _ThreadingHTTPServer(
+                address, _make_http_handler(self))
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            kind, address = parse_address(self.address)
+            if kind == "unix" and os.path.exists(address):
+                os.unlink(address)
+            self.server = None
+
+    def pytest_configure(self, config):
+        config.pluginmanager.register(
+            self.reporter, "testinfra-daemon-nagios")
+
+    def pytest_unconfigure(self):
+        self.stop_server()
+
+    def run_once(self, session):
+        # Statistics of pytest would grow at each run
+        terminalreporter = session.config.pluginmanager.get_plugin(
+            "terminalreporter")
+        if terminalreporter is not None:
+            terminalreporter.stats.clear()
+        session.testsfailed = 0
+        # Hosts may have changed since the previous run
+        for backend in set(filter(None, map(get_item_backend, session.items))):
+            backend.facts.invalidate()
+            backend.clear_prefetched()
+        self.reporter.start(session.config)
+        hook = session.config.hook
+        for i, item in enumerate(session.items):
+            nextitem = session.items[i + 1] if i + 1 < len(
+                session.items) else None
+            hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+        self.reporter.finish()
+        code, output = self.reporter.get_output()
+        self._result = {"code": code, "output": output, "time": time.time()}
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        if session.config.option.collectonly:
+            return True
+        if getattr(session, "testsfailed", 0) and not getattr(
+            session.config.option, "continue_on_collection_errors", False
+        ):
+            raise session.Interrupted(
+                "%d errors during collection" % session.testsfailed)
+        self.start_server()
+        while True:
+            start = time.time()
+            self.run_once(session)
+            time.sleep(max(0, self.interval - (time.time() - start)))
+
+
+def query(address):
+    """Return the exit code and output of the last run of a daemon"""
+    kind, address = parse_address(address)
+    try:
+        if kind == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(address)
+                data = b"".join(iter(lambda: sock.recv(4096), b""))
+            finally:
+                sock.close()
+        else:
+            data = urllib.request.urlopen(
+                "http://%s:%s/json" % address).read()
+        result = json.loads(data.decode("utf-8"))
+    except (IOError, ValueError) as exc:
+        result = _unknown("cannot query daemon: %s" % (exc,))
+    return result["code"], result["output"]
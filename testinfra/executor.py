@@ -0,0 +1,604 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Run tests of different hosts concurrently in threads
+
+Items of a host are all run, in order, by the same worker thread. Each worker
+thread has its own pytest setup state and fixtures cache so that a worker
+behave like a sequential pytest run over its hosts. Reports are logged by the
+main thread in the collection order.
+
+With --testinfra-adaptive, the number of hosts run concurrently is tuned by an
+AIMD controller from the latency and errors of commands.
+
+Output, warnings and logs are captured per thread, so each report only has
+the sections of its own item.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import contextlib
+import logging
+import sys
+import threading
+import warnings
+
+import pytest
+import six
+from six.moves import queue
+
+from testinfra.backend import base
+from testinfra.plugin import get_item_backend
+
+try:
+    from _pytest.fixtures import FixtureDef
+except ImportError:  # pytest < 3.0
+    from _pytest.python import FixtureDef
+from _pytest.runner import runtestprotocol
+from _pytest.runner import SetupState
+
+logger = logging.getLogger("testinfra")
+
+
+class _ThreadLocalAttribute(object):
+    """Data descriptor giving each thread its own value of an attribute"""
+
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+        super(_ThreadLocalAttribute, self).__init__()
+
+    @staticmethod
+    def _local(obj):
+        try:
+            return obj.__dict__["_testinfra_local"]
+        except KeyError:
+            return obj.__dict__.setdefault(
+                "_testinfra_local", threading.local())
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        local = self._local(obj)
+        try:
+            return getattr(local, self.name)
+        except AttributeError:
+            value = self.default()
+            setattr(local, self.name, value)
+            return value
+
+    def __set__(self, obj, value):
+        setattr(self._local(obj), self.name, value)
+
+
+_MISSING = object()
+
+
+def _make_fixtures_thread_local():
+    """Patch FixtureDef, return its previous attributes for
+    _restore_fixtures()"""
+    if isinstance(FixtureDef.__dict__.get("cached_result"),
+                  _ThreadLocalAttribute):
+        return {}
+    # _finalizer for pytest < 3.6
+    names = ("cached_result", "_finalizers", "_finalizer")
+    previous = dict(
+        (name, FixtureDef.__dict__.get(name, _MISSING)) for name in names)
+    FixtureDef.cached_result = _ThreadLocalAttribute(
+        "cached_result", lambda: None)
+    for name in names[1:]:
+        setattr(FixtureDef, name, _ThreadLocalAttribute(name, list))
+    return previous
+
+
+def _restore_fixtures(previous):
+    for name, value in previous.items():
+        if value is _MISSING:
+            delattr(FixtureDef, name)
+        else:
+            setattr(FixtureDef, name, value)
+
+
+class _ThreadLocalStream(object):
+    """Write to the buffer of the current thread when it is capturing"""
+
+    def __init__(self, capture, orig):
+        self._capture = capture
+        self._orig = orig
+        super(_ThreadLocalStream, self).__init__()
+
+    def write(self, data):
+        buf = self._capture.get_buffer(self)
+        if buf is None:
+            return self._orig.write(data)
+        buf.append(data)
+        return len(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self._capture.get_buffer(self) is None:
+            self._orig.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._orig, name)
+
+
+class _ThreadLocalCapture(object):
+    """Stands for the global capture of pytest's capture manager
+
+    Output written to sys.stdout and sys.stderr by a thread is read back by
+    the same thread, file descriptors aren't captured.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.orig = (sys.stdout, sys.stderr)
+        self.streams = (
+            _ThreadLocalStream(self, sys.stdout),
+            _ThreadLocalStream(self, sys.stderr))
+        sys.stdout, sys.stderr = self.streams
+        super(_ThreadLocalCapture, self).__init__()
+
+    def _buffers(self):
+        try:
+            return self.local.buffers
+        except AttributeError:
+            self.local.buffers = ([], [])
+            self.local.capturing = False
+            return self.local.buffers
+
+    def get_buffer(self, stream):
+        buffers = self._buffers()
+        if not self.local.capturing:
+            return None
+        return buffers[self.streams.index(stream)]
+
+    def start_capturing(self):
+        pass
+
+    def resume_capturing(self):
+        self._buffers()
+        self.local.capturing = True
+
+    def suspend_capturing(self, in_=False):
+        # pylint: disable=unused-argument
+        self._buffers()
+        self.local.capturing = False
+
+    def is_started(self):
+        self._buffers()
+        return self.local.capturing
+
+    def readouterr(self):
+        out, err = self._buffers()
+        self.local.buffers = ([], [])
+        return "".join(out), "".join(err)
+
+    def pop_outerr_to_orig(self):
+        out, err = self.readouterr()
+        self.orig[0].write(out)
+        self.orig[1].write(err)
+
+    def stop_capturing(self):
+        sys.stdout, sys.stderr = self.orig
+
+
+class _ThreadLocalWarnings(object):
+    """Replace warnings.catch_warnings() with per thread records
+
+    Filters are shared by all threads, those added in a catch_warnings()
+    block are removed when no other running block added them.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.filters = warnings.filters[:]
+        self.orig = (
+            warnings.catch_warnings, warnings._showwarnmsg_impl,
+            warnings._add_filter)
+        warnings.catch_warnings = self.catch_warnings
+        warnings._showwarnmsg_impl = self.showwarnmsg
+        warnings._add_filter = self.add_filter
+        super(_ThreadLocalWarnings, self).__init__()
+
+    def showwarnmsg(self, msg):
+        log = getattr(self.local, "log", None)
+        if log is None:
+            self.orig[1](msg)
+        else:
+            log.append(msg)
+
+    def add_filter(self, *item, **kwargs):
+        self.orig[2](*item, **kwargs)
+        added = getattr(self.local, "added", None)
+        if added is not None:
+            with self.lock:
+                self.counts[item] += 1
+            added.append(item)
+
+    def _remove_filters(self, added):
+        with self.lock:
+            for item in added:
+                self.counts[item] -= 1
+                if self.counts[item] or item in self.filters:
+                    continue
+                del self.counts[item]
+                try:
+                    warnings.filters.remove(item)
+                except ValueError:
+                    pass
+            warnings._filters_mutated()
+
+    @contextlib.contextmanager
+    def catch_warnings(self, record=False, **kwargs):
+        # pylint: disable=unused-argument
+        previous = (
+            getattr(self.local, "log", None),
+            getattr(self.local, "added", None))
+        if record:
+            self.local.log = []
+        self.local.added = []
+        try:
+            yield self.local.log if record else None
+        finally:
+            self._remove_filters(self.local.added)
+            self.local.log, self.local.added = previous
+
+    def restore(self):
+        (warnings.catch_warnings, warnings._showwarnmsg_impl,
+         warnings._add_filter) = self.orig
+        warnings.filters[:] = self.filters
+        warnings._filters_mutated()
+
+
+class _ThreadFilter(logging.Filter):
+
+    def __init__(self):
+        self.ident = threading.current_thread().ident
+        super(_ThreadFilter, self).__init__()
+
+    def filter(self, record):
+        return record.thread == self.ident
+
+
+def _make_capture_thread_local(config):
+    """Capture output, warnings and logs of items per thread, return
+    callables for _restore_capture()"""
+    restore = []
+    capman = config.pluginmanager.get_plugin("capturemanager")
+    if (
+        capman is not None and getattr(capman, "_method", "no") != "no" and
+        getattr(capman, "_global_capturing", None) is not None
+    ):
+        capman.suspend_global_capture(in_=False)
+        capturing = capman._global_capturing
+        capman._global_capturing = _ThreadLocalCapture()
+
+        def restore_capture():
+            capman._global_capturing.stop_capturing()
+            capman._global_capturing = capturing
+        restore.append(restore_capture)
+
+    # python >= 3.6
+    if hasattr(warnings, "_showwarnmsg_impl") and hasattr(
+        warnings, "_add_filter"
+    ):
+        restore.append(_ThreadLocalWarnings().restore)
+
+    plugin = config.pluginmanager.get_plugin("logging-plugin")
+    if plugin is not None and hasattr(plugin, "report_handler"):
+        handler_class = type(plugin.report_handler)
+
+        def make_handler():
+            handler = handler_class()
+            handler.setFormatter(plugin.formatter)
+            handler.addFilter(_ThreadFilter())
+            return handler
+        names = ("caplog_handler", "report_handler")
+        for name in names:
+            setattr(type(plugin), name, _ThreadLocalAttribute(
+                name, make_handler))
+
+        def restore_logging():
+            for name in names:
+                delattr(type(plugin), name)
+        restore.append(restore_logging)
+    return restore
+
+
+def _restore_capture(restore):
+    for func in reversed(restore):
+        func()
+
+
+class _ThreadLocalSetupState(threading.local):
+
+    def __init__(self):
+        self.state = SetupState()
+        super(_ThreadLocalSetupState, self).__init__()
+
+    def __getattr__(self, name):
+        return getattr(self.state, name)
+
+
+class _Host(object):
+
+    def __init__(self, key):
+        self.key = key
+        self.items = []
+        super(_Host, self).__init__()
+
+
+class AIMDLimiter(object):
+    """Concurrency limit tuned by additive increase, multiplicative decrease
+
+    Commands are reported with on_command(). After `limit` commands without
+    congestion the limit grows by one; a failed connection, a timeout or a
+    mean latency above `tolerance` times the lowest mean latency seen
+    multiply it by `backoff`, at most once per `limit` commands.
+    """
+
+    def __init__(
+        self, maximum, initial=4, minimum=1, backoff=.7, tolerance=3.,
+        smoothing=.2,
+    ):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.limit = max(minimum, min(initial, maximum))
+        self.inflight = 0
+        # limits reached, for reporting
+        self.lowest = self.highest = self.limit
+        # exponential moving average of latency and its lowest value
+        self._latency = None
+        self._baseline = None
+        self._count = 0
+        # commands since the last change of the limit
+        self._samples = 0
+        self._congested = False
+        self._cond = threading.Condition()
+        super(AIMDLimiter, self).__init__()
+
+    def acquire(self, stop=None):
+        """Wait for inflight < limit, return False if `stop` is set"""
+        with self._cond:
+            while self.inflight >= self.limit:
+                if stop is not None and stop.is_set():
+                    return False
+                self._cond.wait(1)
+            self.inflight += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    @staticmethod
+    def is_error(exit_status):
+        # ssh exits with 255 on connection errors, timeouts have no status
+        return exit_status is None or exit_status == 255
+
+    def on_command(self, backend, command, duration, exit_status):
+        with self._cond:
+            self._count += 1
+            self._samples += 1
+            if self._latency is None:
+                self._latency = duration
+            else:
+                self._latency += self.smoothing * (duration - self._latency)
+            if self._count >= 5 and (
+                self._baseline is None or self._latency < self._baseline
+            ):
+                self._baseline = self._latency
+            self._congested = self._congested or self.is_error(
+                exit_status) or (
+                    self._baseline is not None and
+                    self._latency > self.tolerance * self._baseline)
+            if self._samples < self.limit:
+                return
+            if self._congested:
+                limit = max(self.minimum, int(self.limit * self.backoff))
+            else:
+                limit = min(self.maximum, self.limit + 1)
+            self._samples = 0
+            self._congested = False
+            if limit != self.limit:
+                logger.debug(
+                    "Concurrency limit %d -> %d (latency %.3fs)",
+                    self.limit, limit, self._latency)
+                self.limit = limit
+                self.lowest = min(self.lowest, limit)
+                self.highest = max(self.highest, limit)
+                self._cond.notify_all()
+
+
+class ParallelExecutor(object):
+    """pytest plugin running items of different hosts concurrently
+
+    With `adaptive`, at most `workers` hosts are run concurrently and the
+    actual number is tuned by an AIMDLimiter.
+    """
+
+    def __init__(self, workers, adaptive=False):
+        self.workers = workers
+        self.limiter = AIMDLimiter(workers) if adaptive else None
+        self.local = threading.local()
+        # item -> (reports, exc_info), set when item is done
+        self.results = {}
+        self.done = threading.Condition()
+        self.stop = threading.Event()
+        super(ParallelExecutor, self).__init__()
+
+    @staticmethod
+    def get_hosts(items):
+        hosts = collections.OrderedDict()
+        for item in items:
+            backend = get_item_backend(item)
+            key = backend.get_pytest_id() if backend is not None else None
+            if key not in hosts:
+                hosts[key] = _Host(key)
+            hosts[key].items.append(item)
+        return list(hosts.values())
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        if not getattr(self.local, "worker", False):
+            return None
+        # In workers, run the item without logging (done in the main thread)
+        self.local.reports = runtestprotocol(
+            item, log=False, nextitem=nextitem)
+        return True
+
+    def _set_result(self, item, reports, exc_info):
+        with self.done:
+            self.results[item] = (reports, exc_info)
+            self.done.notify_all()
+
+    def _run_host(self, host, next_host):
+        # The last item is followed by the first one of the next host run by
+        # the thread, so session and package fixtures are kept
+        items = host.items + (next_host.items[:1] if next_host else [])
+        for i, item in enumerate(host.items):
+            if self.stop.is_set():
+                return
+            nextitem = items[i + 1] if i + 1 < len(items) else None
+            self.local.reports = []
+            try:
+                item.ihook.pytest_runtest_protocol(
+                    item=item, nextitem=nextitem)
+            except BaseException:  # pylint: disable=broad-except
+                self._set_result(item, None, sys.exc_info())
+                return
+            self._set_result(item, self.local.reports, None)
+
+    @staticmethod
+    def _get_host(hosts):
+        try:
+            return hosts.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _worker(self, hosts):
+        self.local.worker = True
+        host = self._get_host(hosts)
+        while host is not None and not self.stop.is_set():
+            # Taken before running the host to know its first item
+            next_host = self._get_host(hosts)
+            if self.limiter is not None and not self.limiter.acquire(
+                self.stop
+            ):
+                return
+            try:
+                self._run_host(host, next_host)
+            finally:
+                if self.limiter is not None:
+                    self.limiter.release()
+            host = next_host
+
+    def _wait(self, item):
+        with self.done:
+            while item not in self.results:
+                self.done.wait(1)
+            return self.results.pop(item)
+
+    @staticmethod
+    def _log(item, reports):
+        item.ihook.pytest_runtest_logstart(
+            nodeid=item.nodeid, location=item.location)
+        for report in reports:
+            item.ihook.pytest_runtest_logreport(report=report)
+        if hasattr(item.ihook, "pytest_runtest_logfinish"):
+            item.ihook.pytest_runtest_logfinish(
+                nodeid=item.nodeid, location=item.location)
+
+    @staticmethod
+    def get_queue(hosts, durations=None):
+        """Return a queue of hosts, longest expected duration first
+
+        Starting slow hosts first avoids a long tail at the end of the run.
+        Durations come from previous runs (see scheduling.HostDurations),
+        hosts without history are expected to be as slow as the mean host.
+        """
+        def expected_duration(host):
+            duration = None
+            if durations is not None and host.key is not None:
+                duration = durations.get_expected_duration(
+                    host.key, len(host.items))
+            return len(host.items) if duration is None else duration
+
+        hosts_queue = queue.Queue()
+        for host in sorted(hosts, key=lambda h: -expected_duration(h)):
+            hosts_queue.put(host)
+        return hosts_queue
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        if session.config.option.collectonly or not session.items:
+            return None
+        if getattr(session, "testsfailed", 0) and not getattr(
+            session.config.option, "continue_on_collection_errors", False
+        ):
+            raise session.Interrupted(
+                "%d errors during collection" % session.testsfailed)
+
+        fixtures = _make_fixtures_thread_local()
+        capture = _make_capture_thread_local(session.config)
+        setupstate = session._setupstate
+        session._setupstate = _ThreadLocalSetupState()
+        hosts_queue = self.get_queue(
+            self.get_hosts(session.items),
+            session.config.pluginmanager.get_plugin("testinfra-durations"))
+        if self.limiter is not None:
+            base.command_listeners.append(self.limiter.on_command)
+        threads = []
+        for _ in range(min(self.workers, hosts_queue.qsize())):
+            thread = threading.Thread(target=self._worker, args=(hosts_queue,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            for item in session.items:
+                reports, exc_info = self._wait(item)
+                if exc_info is not None:
+                    six.reraise(*exc_info)
+                self._log(item, reports)
+                if session.shouldfail:
+                    raise session.Failed(session.shouldfail)
+                if session.shouldstop:
+                    raise session.Interrupted(session.shouldstop)
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+            session._setupstate = setupstate
+            _restore_fixtures(fixtures)
+            _restore_capture(capture)
+            if self.limiter is not None:
+                base.command_listeners.remove(self.limiter.on_command)
+        return True
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.limiter is not None:
+            terminalreporter.write_sep("-", (
+                "testinfra adaptive concurrency: %d hosts (lowest %d, "
+                "highest %d)") % (
+                    self.limiter.limit, self.limiter.lowest,
+                    self.limiter.highest))
@@ -0,0 +1,184 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Run the test suite host by host on a large fleet
+
+Tests are collected once with a placeholder backend, then for each host
+read from the hosts iterator the backend is created, all tests are run
+against it and the backend is closed and freed. Collection time and memory
+don't depend on the number of hosts:
+
+    $ testinfra --testinfra-fleet=hosts.txt test_myinfra.py
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import io
+import sys
+
+import pytest
+
+import testinfra.backend
+from testinfra import selection
+from testinfra import shard
+from testinfra.plugin import get_backend_kwargs
+
+# id of the placeholder backend, replaced by the host in nodeids
+FLEET_ID = "testinfra-fleet"
+
+
+def _read_stdin(config):
+    # stdin is replaced while output is captured. Hosts are read between
+    # tests where the capture is suspended except for stdin.
+    capman = config.pluginmanager.getplugin("capturemanager")
+    while True:
+        if capman is not None:
+            capman.suspend_global_capture(in_=True)
+        try:
+            line = sys.stdin.readline()
+        finally:
+            if capman is not None:
+                capman.resume_global_capture()
+                capman.suspend_global_capture()
+        if not line:
+            return
+        yield line
+
+
+def _read_file(path):
+    with io.open(path, encoding="utf-8") as f:
+        for line in f:
+            yield line
+
+
+def read_hosts(config, path):
+    """Yield hostspecs of a file ("-" for stdin), one per line"""
+    lines = _read_stdin(config) if path == "-" else _read_file(path)
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+class Fleet(object):
+    """pytest plugin running the collected tests for each host in turn"""
+
+    def __init__(self, config):
+        self.config = config
+        super(Fleet, self).__init__()
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_testinfra_fleet_hosts(self, config):
+        return read_hosts(config, config.option.testinfra_fleet)
+
+    def get_backends(self):
+        # With --testinfra-warmup, read ahead and warm up the next hosts
+        warmup = self.config.pluginmanager.get_plugin("testinfra-warmup")
+        pending = collections.deque()
+        for backend in self._get_backends():
+            pending.append(backend)
+            if warmup is not None:
+                warmup.submit([backend])
+            if len(pending) > (warmup.concurrency if warmup else 0):
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+    def _get_backends(self):
+        kwargs = get_backend_kwargs(self.config)
+        # Hosts are not known in advance, only use the hash to shard
+        shard_option = self.config.option.testinfra_shard
+        for hostspec in self.config.hook.pytest_testinfra_fleet_hosts(
+            config=self.config,
+        ):
+            for backend in testinfra.backend.get_backends(
+                [hostspec], **kwargs
+            ):
+                if shard_option is None or shard.select(
+                    [backend], shard_option
+                ):
+                    yield backend
+
+    def get_hosts(self, items):
+        """Yield backends of hosts having tests and the items they run"""
+        for backend in self.get_backends():
+            selected = [
+                item for item in items
+                if selection.matches_item(backend, item)]
+            if selected:
+                yield backend, selected
+            else:
+                backend.close()
+
+    @staticmethod
+    def run_items(session, items, nextitem=None):
+        """Run items, the last one is followed by `nextitem`"""
+        for i, item in enumerate(items):
+            item.ihook.pytest_runtest_protocol(
+                item=item,
+                nextitem=items[i + 1] if i + 1 < len(items) else nextitem)
+            if session.shouldfail:
+                raise session.Failed(session.shouldfail)
+            if session.shouldstop:
+                raise session.Interrupted(session.shouldstop)
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        if session.config.option.collectonly:
+            return True
+        if getattr(session, "testsfailed", 0) and not getattr(
+            session.config.option, "continue_on_collection_errors", False
+        ):
+            raise session.Interrupted(
+                "%d errors during collection" % session.testsfailed)
+
+        items = []
+        others = []
+        for item in session.items:
+            callspec = getattr(item, "callspec", None)
+            if callspec is not None and (
+                "_testinfra_backend" in callspec.params
+            ):
+                items.append((item, item.nodeid))
+            else:
+                others.append(item)
+        # The last item of a host is followed by the first item of the next
+        # host, so session and package scoped fixtures are set up once
+        hosts = self.get_hosts([item for item, _ in items])
+        host = next(hosts, None)
+        self.run_items(session, others, host[1][0] if host else None)
+        prefetch = self.config.pluginmanager.get_plugin("testinfra-prefetch")
+        try:
+            while host is not None:
+                backend, selected = host
+                pytest_id = backend.get_pytest_id()
+                for item, nodeid in items:
+                    item.callspec.params["_testinfra_backend"] = backend
+                    item._nodeid = nodeid.replace(FLEET_ID, pytest_id, 1)
+                try:
+                    host = next(hosts, None)
+                    self.run_items(
+                        session, selected, host[1][0] if host else None)
+                finally:
+                    # Items of the next host still had this backend when
+                    # the last item was torn down
+                    if prefetch is not None and id(backend) in (
+                        prefetch.current
+                    ):
+                        prefetch.finish(backend)
+                    backend.close()
+        finally:
+            for item, nodeid in items:
+                item.callspec.params["_testinfra_backend"] = None
+                item._nodeid = nodeid
+        return True
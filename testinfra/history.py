@@ -0,0 +1,318 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Store sessions, tests and commands timings in a SQLite database
+
+    $ testinfra --history-db=history.sqlite test_myinfra.py
+    $ testinfra-history history.sqlite regressions
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import collections
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+import pytest
+import six
+
+from testinfra.backend import base
+from testinfra.plugin import get_item_backend
+
+# Number of pending rows triggering a write to the database
+BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    start REAL NOT NULL,
+    duration REAL,
+    passed INTEGER,
+    failed INTEGER,
+    skipped INTEGER
+);
+CREATE TABLE IF NOT EXISTS tests (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    nodeid TEXT NOT NULL,
+    host TEXT,
+    outcome TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commands (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    nodeid TEXT,
+    host TEXT NOT NULL,
+    command TEXT NOT NULL,
+    duration REAL NOT NULL,
+    exit_status INTEGER
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    host TEXT NOT NULL,
+    facts TEXT,
+    commands INTEGER,
+    command_time REAL,
+    connect_time REAL
+);
+CREATE INDEX IF NOT EXISTS tests_session ON tests(session_id);
+CREATE INDEX IF NOT EXISTS commands_session ON commands(session_id);
+"""
+
+
+def connect(path):
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+class HistoryStore(object):
+    """pytest plugin recording the session in a SQLite database
+
+    Commands are buffered (possibly from other threads) and written by
+    batches from the main thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        # The SQLite connection can only be used by its thread
+        self.thread = None
+        self.session_id = None
+        # current test of each thread (see --testinfra-workers)
+        self.local = threading.local()
+        self.counts = {"passed": 0, "failed": 0, "skipped": 0}
+        # nodeid -> [host, outcome, duration]
+        self.tests = {}
+        self.backends = {}
+        self.pending_tests = collections.deque()
+        self.pending_commands = collections.deque()
+        self.start_time = None
+        super(HistoryStore, self).__init__()
+
+    def on_command(self, backend, command, duration, exit_status):
+        if isinstance(command, six.binary_type):
+            command = backend.decode(command)
+        host = backend.get_pytest_id()
+        self.backends.setdefault(host, backend)
+        self.pending_commands.append((
+            self.session_id, getattr(self.local, "nodeid", None), host,
+            command, duration, exit_status))
+
+    def pytest_configure(self, config):
+        self.db = connect(self.path)
+        self.thread = threading.current_thread()
+        self.start_time = time.time()
+        with self.db:
+            self.session_id = self.db.execute(
+                "INSERT INTO sessions (start) VALUES (?)",
+                (self.start_time,)).lastrowid
+        base.command_listeners.append(self.on_command)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        backend = get_item_backend(item)
+        host = backend.get_pytest_id() if backend is not None else None
+        self.tests[item.nodeid] = [host, "passed", 0.]
+        self.local.nodeid = item.nodeid
+        yield
+        self.local.nodeid = None
+
+    def pytest_runtest_logreport(self, report):
+        # Reports are logged by the main thread, possibly after the end of
+        # the test in a worker thread (see --testinfra-workers)
+        test = self.tests.get(report.nodeid)
+        if test is None:
+            return
+        test[2] += report.duration
+        if report.failed:
+            test[1] = "failed"
+        elif report.skipped and test[1] != "failed":
+            test[1] = "skipped"
+        if report.when == "teardown":
+            host, outcome, duration = self.tests.pop(report.nodeid)
+            self.counts[outcome] += 1
+            self.pending_tests.append((
+                self.session_id, report.nodeid, host, outcome, duration))
+            self.flush_batch()
+
+    def flush_batch(self):
+        if (
+            threading.current_thread() is self.thread and
+            len(self.pending_tests) + len(self.pending_commands) > BATCH_SIZE
+        ):
+            self.flush()
+
+    def flush(self):
+        # pop rows one by one since other threads may append meanwhile
+        tests = [
+            self.pending_tests.popleft()
+            for _ in range(len(self.pending_tests))]
+        commands = [
+            self.pending_commands.popleft()
+            for _ in range(len(self.pending_commands))]
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO tests VALUES (?, ?, ?, ?, ?)", tests)
+            self.db.executemany(
+                "INSERT INTO commands VALUES (?, ?, ?, ?, ?, ?)", commands)
+
+    def get_facts(self, backend):
+        # Only store already discovered facts, don't run commands for this
+        sysinfo = backend.get_module("SystemInfo")._sysinfo
+        if sysinfo is not None:
+            return json.dumps(sysinfo, sort_keys=True)
+        return None
+
+    def pytest_sessionfinish(self):
+        base.command_listeners.remove(self.on_command)
+        self.flush()
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO hosts VALUES (?, ?, ?, ?, ?, ?)", [(
+                    self.session_id, host, self.get_facts(backend),
+                    backend.command_count, backend.command_time,
+                    backend.connect_time,
+                ) for host, backend in sorted(self.backends.items())])
+            self.db.execute((
+                "UPDATE sessions SET duration=?, passed=?, failed=?, "
+                "skipped=? WHERE id=?"), (
+                    time.time() - self.start_time, self.counts["passed"],
+                    self.counts["failed"], self.counts["skipped"],
+                    self.session_id))
+        self.db.close()
+
+
+def _print_rows(headers, rows):
+    rows = [headers] + [
+        ["" if v is None else (
+            "%.3f" % (v,) if isinstance(v, float) else six.text_type(v))
+         for v in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(headers))]
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip())
+
+
+def _last_sessions(db, count):
+    return [row[0] for row in db.execute(
+        "SELECT id FROM sessions WHERE duration IS NOT NULL "
+        "ORDER BY id DESC LIMIT ?", (count,))]
+
+
+def cmd_sessions(db, args):
+    _print_rows(
+        ["id", "start", "duration", "passed", "failed", "skipped"], [
+            (r[0], time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r[1])),
+             r[2], r[3], r[4], r[5])
+            for r in db.execute(
+                "SELECT * FROM sessions ORDER BY id DESC LIMIT ?",
+                (args.limit,))])
+
+
+def cmd_trend(db, args):
+    if args.command is not None:
+        query = (
+            "SELECT session_id, host, COUNT(*), AVG(duration), MAX(duration) "
+            "FROM commands WHERE command LIKE ? ")
+        param = args.command
+    else:
+        query = (
+            "SELECT session_id, host, COUNT(*), AVG(duration), MAX(duration) "
+            "FROM tests WHERE nodeid LIKE ? ")
+        param = args.test or "%"
+    if args.host is not None:
+        query += "AND host = ? "
+        params = (param, args.host)
+    else:
+        params = (param,)
+    query += (
+        "AND session_id IN (%s) GROUP BY session_id, host "
+        "ORDER BY host, session_id") % (
+            ",".join(str(i) for i in _last_sessions(db, args.limit)),)
+    _print_rows(
+        ["session", "host", "count", "avg", "max"], db.execute(query, params))
+
+
+def cmd_regressions(db, args):
+    sessions = _last_sessions(db, 2)
+    if len(sessions) < 2:
+        print("Need at least two sessions to compare")
+        return 1
+    new, old = sessions
+    rows = []
+    for table, key in (("tests", "nodeid"), ("commands", "command")):
+        query = (
+            "SELECT host, {key}, AVG(duration) FROM {table} "
+            "WHERE session_id = ? GROUP BY host, {key}"
+        ).format(key=key, table=table)
+        before = dict(((r[0], r[1]), r[2]) for r in db.execute(query, (old,)))
+        for host, name, duration in db.execute(query, (new,)):
+            previous = before.get((host, name))
+            if (
+                previous and duration >= args.min_duration and
+                duration / previous >= args.factor
+            ):
+                rows.append((
+                    table[:-1], host, name, previous, duration,
+                    "x%.1f" % (duration / previous,)))
+    rows.sort(key=lambda r: r[4] / r[3], reverse=True)
+    print("Comparing session %s to session %s" % (new, old))
+    _print_rows(["type", "host", "name", "before", "after", "ratio"], rows)
+    return 1 if rows else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Report trends and regressions from a testinfra "
+        "history database (see --history-db)")
+    parser.add_argument("db", help="Path to the SQLite database")
+    subparsers = parser.add_subparsers(dest="action")
+    subparsers.required = True
+
+    sessions = subparsers.add_parser("sessions", help="List sessions")
+    sessions.add_argument("--limit", type=int, default=20)
+    sessions.set_defaults(func=cmd_sessions)
+
+    trend = subparsers.add_parser(
+        "trend", help="Durations of tests or commands over last sessions")
+    trend.add_argument("--test", help="Test nodeid (SQL LIKE pattern)")
+    trend.add_argument("--command", help="Command (SQL LIKE pattern)")
+    trend.add_argument("--host", help="Host (pytest id)")
+    trend.add_argument("--limit", type=int, default=10)
+    trend.set_defaults(func=cmd_trend)
+
+    regressions = subparsers.add_parser(
+        "regressions",
+        help="Tests and commands slower than in the previous session")
+    regressions.add_argument(
+        "--factor", type=float, default=2.,
+        help="Report durations increased by at least this factor")
+    regressions.add_argument(
+        "--min-duration", type=float, default=.01,
+        help="Ignore durations below this value (seconds)")
+    regressions.set_defaults(func=cmd_regressions)
+
+    args = parser.parse_args(argv)
+    db = connect(args.db)
+    try:
+        return args.func(db, args) or 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Hooks which can be implemented in conftest.py files or plugins"""
+
+from __future__ import unicode_literals
+
+import pytest
+
+
+@pytest.hookspec(firstresult=True)
+def pytest_testinfra_fleet_hosts(config):
+    """Return an iterable of hostspecs to test in fleet mode
+
+    Hosts are consumed one by one while the tests run, so this can be a
+    generator (e.g. reading an inventory API). The default implementation
+    reads the file given to ``--testinfra-fleet``.
+    """
@@ -0,0 +1,158 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Skip tests which passed on hosts that didn't change since then
+
+A host fingerprint is computed in one command per host, hosts are
+fingerprinted concurrently. When both the fingerprint and the test code are
+the same as the last time the test passed, the test is skipped.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+import os
+import threading
+
+import pytest
+from six.moves import queue
+
+from testinfra.plugin import get_item_backend
+
+logger = logging.getLogger("testinfra")
+
+CACHE_KEY = "testinfra/incremental"
+
+# Maximum number of hosts fingerprinted at the same time
+CONCURRENCY = 100
+
+# boot id, packages databases mtime, most recent mtime in /etc and a
+# checksum of systemd units states
+FINGERPRINT_COMMAND = (
+    "cat /proc/sys/kernel/random/boot_id 2>/dev/null; "
+    "ls -l --time-style=+%s /var/lib/dpkg/status /var/lib/rpm 2>/dev/null; "
+    "find /etc -xdev -printf '%T@\\n' 2>/dev/null | sort -n | tail -n 1; "
+    "systemctl list-units --all --no-legend --plain 2>/dev/null | cksum"
+)
+
+
+def get_fingerprint(backend):
+    """Return the fingerprint of the host or None when unavailable"""
+    try:
+        out = backend.run(FINGERPRINT_COMMAND)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.warning(
+            "Cannot compute fingerprint of %s: %s",
+            backend.get_pytest_id(), exc)
+        return None
+    if not out.stdout.strip():
+        return None
+    return hashlib.sha1(out.stdout_bytes).hexdigest()
+
+
+def get_fingerprints(backends, concurrency=CONCURRENCY):
+    """Return {pytest id: fingerprint or None}, hosts are fingerprinted
+    concurrently"""
+    backends = list(backends)
+    fingerprints = {}
+    tasks = queue.Queue()
+    for backend in backends:
+        tasks.put(backend)
+
+    def worker():
+        while True:
+            try:
+                backend = tasks.get_nowait()
+            except queue.Empty:
+                return
+            fingerprints[backend.get_pytest_id()] = get_fingerprint(backend)
+
+    threads = [
+        threading.Thread(target=worker)
+        for _ in range(min(concurrency, len(backends)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return fingerprints
+
+
+class Incremental(object):
+    """pytest plugin skipping tests unchanged since their last pass"""
+
+    def __init__(self, config, concurrency=CONCURRENCY):
+        self.config = config
+        self.concurrency = concurrency
+        self.results = config.cache.get(CACHE_KEY, {})
+        # pytest id -> fingerprint
+        self.fingerprints = {}
+        # path -> hash
+        self.code_hashes = {}
+        # nodeid -> [fingerprint, code hash] of collected items
+        self.keys = {}
+        super(Incremental, self).__init__()
+
+    def get_code_hash(self, item):
+        path = str(item.fspath)
+        if path not in self.code_hashes:
+            sha = hashlib.sha1()
+            paths = [path]
+            directory = os.path.dirname(path)
+            rootdir = str(self.config.rootdir)
+            while directory.startswith(rootdir):
+                paths.append(os.path.join(directory, "conftest.py"))
+                directory, parent = os.path.dirname(directory), directory
+                if directory == parent:
+                    break
+            for p in paths:
+                if os.path.exists(p):
+                    with open(p, "rb") as f:
+                        sha.update(f.read())
+            self.code_hashes[path] = sha.hexdigest()
+        return self.code_hashes[path]
+
+    def pytest_collection_modifyitems(self, items):
+        backends = {}
+        for item in items:
+            backend = get_item_backend(item)
+            if backend is not None and (
+                backend.get_pytest_id() not in self.fingerprints
+            ):
+                backends.setdefault(backend.get_pytest_id(), backend)
+        self.fingerprints.update(
+            get_fingerprints(backends.values(), self.concurrency))
+        for item in items:
+            backend = get_item_backend(item)
+            if backend is None:
+                continue
+            fingerprint = self.fingerprints[backend.get_pytest_id()]
+            if fingerprint is None:
+                continue
+            key = [fingerprint, self.get_code_hash(item)]
+            self.keys[item.nodeid] = key
+            if self.results.get(item.nodeid) == key:
+                item.add_marker(pytest.mark.skip(
+                    reason="host and test unchanged since last pass"))
+
+    def pytest_runtest_logreport(self, report):
+        key = self.keys.get(report.nodeid)
+        if key is None or self.results.get(report.nodeid) == key:
+            return
+        if report.failed:
+            self.results.pop(report.nodeid, None)
+        elif report.passed and report.when == "call":
+            self.results[report.nodeid] = key
+
+    def pytest_sessionfinish(self):
+        self.config.cache.set(CACHE_KEY, self.results)
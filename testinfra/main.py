@@ -11,29 +11,81 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import shutil
 import sys
 import tempfile
 import time
 
 import pytest
+from testinfra.plugin import get_item_backend
+
+
+def _perfdata(label, value, uom="", warning=None, critical=None):
+    # https://nagios-plugins.org/doc/guidelines.html#AEN200
+    label = label.replace("'", "''").replace("=", "_")
+    if isinstance(value, float):
+        value = "%.3f" % (value,)
+    data = "'%s'=%s%s" % (label, value, uom)
+    if warning is not None or critical is not None:
+        data += ";%s;%s" % (
+            "" if warning is None else warning,
+            "" if critical is None else critical)
+    return data
 
 
 class NagiosReporter(object):
 
     def __init__(self):
+        self.warning = None
+        self.critical = None
+        self.reset()
+        super(NagiosReporter, self).__init__()
+
+    def reset(self):
         self.passed = 0
         self.failed = 0
         self.skipped = 0
+        self.failures = []
         self.start_time = None
         self.total_time = None
-        super(NagiosReporter, self).__init__()
+        # nodeid -> wall time (setup, call and teardown)
+        self.durations = collections.OrderedDict()
+        # pytest id -> (backend, command_count, connect_time, queue_time)
+        self.backends = collections.OrderedDict()
+        # pytest id -> list of nodeid
+        self.host_items = collections.defaultdict(list)
+
+    def start(self, config):
+        self.reset()
+        self.start_time = time.time()
+        self.warning = config.option.nagios_warning
+        self.critical = config.option.nagios_critical
+
+    def finish(self):
+        self.total_time = time.time() - self.start_time
 
     def pytest_sessionstart(self, session):
-        self.start_time = time.time()
+        self.start(session.config)
 
     def pytest_sessionfinish(self):
-        self.total_time = time.time() - self.start_time
+        self.finish()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        backend = get_item_backend(item)
+        if backend is not None:
+            host = backend.get_pytest_id()
+            # Backends may be reused between runs (see --daemon), keep
+            # counters at the time we first see them
+            self.backends.setdefault(host, (
+                backend, backend.command_count, backend.connect_time,
+                backend.queue_time))
+        start = time.time()
+        yield
+        self.durations[item.nodeid] = time.time() - start
+        if backend is not None:
+            self.host_items[host].append(item.nodeid)
 
     def pytest_runtest_logreport(self, report):
         if report.passed:
@@ -41,24 +93,92 @@ class NagiosReporter(object):
                 self.passed += 1
         elif report.failed:
             self.failed += 1
+            self.failures.append(report.nodeid)
         elif report.skipped:
             self.skipped += 1
 
-    def report(self):
-        if self.failed:
-            status = "CRITICAL"
-            ret = 2
+    def get_status(self):
+        if self.failed or (
+            self.critical is not None and self.total_time > self.critical
+        ):
+            return "CRITICAL", 2
+        elif self.warning is not None and self.total_time > self.warning:
+            return "WARNING", 1
         else:
-            status = "OK"
-            ret = 0
-
-        sys.stdout.write((
-            b"TESTINFRA %s - %d passed, %d failed, %d skipped in %.2f "
-            b"seconds\n") % (
-                status, self.passed, self.failed, self.skipped, self.total_time
-            ))
+            return "OK", 0
+
+    def get_perfdata(self):
+        """Return the perfdata of the status line"""
+        perfdata = [
+            _perfdata(
+                "time", self.total_time, "s", self.warning, self.critical),
+            _perfdata("passed", self.passed),
+            _perfdata("failed", self.failed),
+            _perfdata("skipped", self.skipped),
+        ]
+        if self.durations:
+            perfdata.append(_perfdata(
+                "slowest_test", max(self.durations.values()), "s"))
+        return perfdata
+
+    def get_long_perfdata(self):
+        """Return per host and per check perfdata"""
+        perfdata = []
+        for host, (
+            backend, commands, connect_time, queue_time,
+        ) in self.backends.items():
+            durations = [self.durations[n] for n in self.host_items[host]]
+            if not durations:
+                # No finished test (e.g. interrupted session)
+                durations = [0.]
+            perfdata.extend([
+                _perfdata(host + " time", sum(durations), "s"),
+                _perfdata(
+                    host + " connect_time",
+                    backend.connect_time - connect_time, "s"),
+                _perfdata(
+                    host + " queue_time",
+                    backend.queue_time - queue_time, "s"),
+                _perfdata(
+                    host + " commands", backend.command_count - commands),
+                _perfdata(host + " slowest_test", max(durations), "s"),
+            ])
+        for nodeid, duration in self.durations.items():
+            perfdata.append(_perfdata(nodeid, duration, "s"))
+        return perfdata
+
+    def get_status_line(self):
+        status, ret = self.get_status()
+        return ret, (
+            "TESTINFRA %s - %d passed, %d failed, %d skipped in %.2f "
+            "seconds | %s") % (
+                status, self.passed, self.failed, self.skipped,
+                self.total_time, " ".join(self.get_perfdata()),
+            )
+
+    def get_output(self):
+        """Return the exit code and the full plugin output
+
+        Used when the tests output isn't available (see --daemon)
+        """
+        ret, line = self.get_status_line()
+        lines = [line]
+        lines.extend("FAILED " + nodeid for nodeid in self.failures)
+        perfdata = self.get_long_perfdata()
+        if perfdata:
+            lines.append("| " + "\n".join(perfdata))
+        return ret, "\n".join(lines) + "\n"
+
+    def report(self):
+        ret, line = self.get_status_line()
+        sys.stdout.write(line + "\n")
         return ret
 
+    def report_long_perfdata(self):
+        perfdata = self.get_long_perfdata()
+        if perfdata:
+            sys.stdout.write("| " + "\n".join(perfdata) + "\n")
+
 
 class RedirectStdStreams(object):
     # http://stackoverflow.com/questions/6796492/temporarily-redirect-stdout-stderr
@@ -82,17 +202,34 @@ class RedirectStdStreams(object):
         sys.stderr = self._old_stderr
 
 
+def _get_argument(name):
+    for i, arg in enumerate(sys.argv):
+        if arg == name and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+        elif arg.startswith(name + "="):
+            return arg[len(name) + 1:]
+    return None
+
+
 def main():
-    if "--nagios" in sys.argv:
-        out = tempfile.SpooledTemporaryFile()
-        # Compat: In 2.7 SpooledTemporaryFile has no encoding param
-        out.encoding = sys.stdout.encoding
+    daemon_query = _get_argument("--daemon-query")
+    if daemon_query is not None:
+        from testinfra import daemon
+        ret, output = daemon.query(daemon_query)
+        sys.stdout.write(output)
+        return ret
+    elif "--nagios" in sys.argv:
+        out = tempfile.SpooledTemporaryFile(mode="w+")
+        if sys.version_info[0] == 2:
+            # Compat: In 2.7 SpooledTemporaryFile has no encoding param
+            out.encoding = sys.stdout.encoding
         nagios_reporter = NagiosReporter()
         with RedirectStdStreams(stdout=out, stderr=out):
             pytest.main(plugins=[nagios_reporter])
         ret = nagios_reporter.report()
         out.seek(0)
         shutil.copyfileobj(out, sys.stdout)
+        nagios_reporter.report_long_perfdata()
         return ret
     else:
         return pytest.main()
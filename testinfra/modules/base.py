@@ -13,15 +13,208 @@
 
 from __future__ import unicode_literals
 
+import functools
+import operator
+import sys
+
 import pytest
+import six
+
+
+class CommandNeeded(BaseException):
+    """Raised by modules evaluated with BaseBackend.aevaluate() when a
+    command has not been awaited yet"""
+
+
+class Deferred(object):
+    """Value of a module property evaluated when it is used
+
+    Returned by the probes of modules of lazy backends (see
+    BaseBackend.defer()), it behaves like the value in tests (bool(),
+    comparisons, arithmetic, str(), attributes...) but isn't an instance of
+    its type and isn't identical to it, use get() for this (e.g. ``is
+    None``, ``isinstance()`` or ``json.dumps()``).
+    """
+    _pending = object()
+    _attrs = ("backend", "instance", "name", "func", "value", "exc_info")
+
+    def __init__(self, backend, instance, name, func):
+        self.backend = backend
+        self.instance = instance
+        self.name = name
+        self.func = func
+        self.value = self._pending
+        self.exc_info = None
+
+    def set(self, value, exc_info=None):
+        self.value = value
+        self.exc_info = exc_info
+
+    def get(self):
+        """Return the value, evaluating pending values of the backend"""
+        __tracebackhide__ = True  # pylint: disable=unused-variable
+        if self.value is self._pending and self.exc_info is None:
+            self.backend.flush_deferred()
+        if self.value is self._pending and self.exc_info is None:
+            # Created in another thread, discarded, or still needing
+            # commands after all batches
+            try:
+                self.set(self.func())
+            except (Exception, pytest.fail.Exception):
+                self.set(None, sys.exc_info())
+        if self.exc_info is not None:
+            six.reraise(*self.exc_info)
+        return self.value
+
+    def __getattr__(self, name):
+        if name in self._attrs or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __bool__(self):
+        return bool(self.get())
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return repr(self.get())
+
+    def __str__(self):
+        return str(self.get())
+
+    def __unicode__(self):
+        return six.text_type(self.get())
+
+    def __hash__(self):
+        return hash(self.get())
+
+    def __format__(self, spec):
+        return format(self.get(), spec)
+
+    def __len__(self):
+        return len(self.get())
+
+    def __iter__(self):
+        return iter(self.get())
+
+    def __contains__(self, item):
+        return item in self.get()
+
+    def __int__(self):
+        return int(self.get())
+
+    def __float__(self):
+        return float(self.get())
+
+    def __index__(self):
+        return operator.index(self.get())
+
+
+def _get_value(value):
+    return value.get() if isinstance(value, Deferred) else value
+
+
+def _deferred_operator(func, reflected=False):
+    if reflected:
+        return lambda self, other: func(_get_value(other), self.get())
+    return lambda self, other: func(self.get(), _get_value(other))
+
+
+for _name in (
+    "lt", "le", "eq", "ne", "gt", "ge", "getitem",
+    "add", "sub", "mul", "mod", "floordiv", "truediv",
+    "and", "or", "xor", "lshift", "rshift",
+):
+    _func = getattr(operator, "__%s__" % (_name,))
+    setattr(Deferred, "__%s__" % (_name,), _deferred_operator(_func))
+    if _name not in ("lt", "le", "eq", "ne", "gt", "ge", "getitem"):
+        setattr(Deferred, "__r%s__" % (_name,), _deferred_operator(
+            _func, reflected=True))
+del _name, _func
+if six.PY2:
+    Deferred.__div__ = _deferred_operator(operator.div)
+    Deferred.__rdiv__ = _deferred_operator(operator.div, reflected=True)
+
+
+class DeferredProperty(object):
+    """Property returning Deferred values on lazy backends"""
+
+    def __init__(self, name, prop):
+        self.name = name
+        self.prop = prop
+        self.__doc__ = prop.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        func = functools.partial(self.prop.__get__, instance, owner)
+        if getattr(instance._backend._local, "results", None) is not None:
+            # Evaluated by aevaluate() or BaseBackend.evaluate_probes()
+            return func()
+        return instance._backend.defer(instance, self.name, func)
 
 
 class Module(object):
     _backend = None
+    # Timeout of commands run by the module, default to the timeout of the
+    # backend (see BaseBackend.get_timeout())
+    timeout = None
+    # Commands of the module only read the state of the host, so their
+    # results can be prefetched (see BaseBackend.get_prefetched())
+    prefetchable = True
+    # Properties of instances evaluated by BaseBackend.prefetch(), they
+    # return Deferred values on lazy backends
+    probes = ()
 
     def run(self, command, *args, **kwargs):
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+        results = getattr(self._backend._local, "results", None)
+        if results is not None:
+            try:
+                return results[(command, args)]
+            except KeyError:
+                raise CommandNeeded(command, args, kwargs)
+        if self.prefetchable:
+            out = self._backend.get_prefetched(command, *args)
+            if out is not None:
+                return out
+        else:
+            self._backend.flush_deferred()
         return self._backend.run(command, *args, **kwargs)
 
+    def arun(self, command, *args, **kwargs):
+        """Coroutine version of run()"""
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+        return self._backend.arun(command, *args, **kwargs)
+
+    def aget(self, name):
+        """Coroutine returning the attribute `name` of the module
+
+        >>> await Package("nginx").aget("is_installed")
+        True
+        """
+        return self._backend.aevaluate(getattr, self, name)
+
+    @staticmethod
+    def _check_exit_status(expected, out):
+        __tracebackhide__ = True  # pylint: disable=unused-variable
+        if out.timed_out:
+            pytest.fail("Timeout expired for %s" % (out,))
+        if out.rc not in expected:
+            pytest.fail("Unexpected exit code %s for %s" % (out.rc, out))
+        return out
+
+    @staticmethod
+    def _get_output(out):
+        __tracebackhide__ = True  # pylint: disable=unused-variable
+        if out.timed_out:
+            pytest.fail("Timeout expired for %s" % (out,))
+        if out.rc != 0:
+            pytest.fail("Unexpected exit code %s for %s" % (out.rc, out))
+        return out.stdout.rstrip("\r\n")
+
     def run_expect(self, expected, command, *args, **kwargs):
         """Run command and check it return an expected exit status
 
@@ -29,10 +222,15 @@ class Module(object):
         :raises: AssertionError
         """
         __tracebackhide__ = True  # pylint: disable=unused-variable
-        out = self.run(command, *args, **kwargs)
-        if out.rc not in expected:
-            pytest.fail("Unexpected exit code %s for %s" % (out.rc, out))
-        return out
+        return self._check_exit_status(
+            expected, self.run(command, *args, **kwargs))
+
+    def arun_expect(self, expected, command, *args, **kwargs):
+        """Coroutine version of run_expect()"""
+        from testinfra.utils import aio
+        return aio.then(
+            self.arun(command, *args, **kwargs),
+            functools.partial(self._check_exit_status, expected))
 
     def run_test(self, command, *args, **kwargs):
         """Run command and check it return an exit status of 0 or 1
@@ -41,6 +239,10 @@ class Module(object):
         """
         return self.run_expect([0, 1], command, *args, **kwargs)
 
+    def arun_test(self, command, *args, **kwargs):
+        """Coroutine version of run_test()"""
+        return self.arun_expect([0, 1], command, *args, **kwargs)
+
     def check_output(self, command, *args, **kwargs):
         """Get stdout of a command which has run successfully
 
@@ -48,17 +250,21 @@ class Module(object):
         :raises: AssertionError
         """
         __tracebackhide__ = True  # pylint: disable=unused-variable
-        out = self.run(command, *args, **kwargs)
-        if out.rc != 0:
-            pytest.fail("Unexpected exit code %s for %s" % (out.rc, out))
-        return out.stdout.rstrip("\r\n")
+        return self._get_output(self.run(command, *args, **kwargs))
+
+    def acheck_output(self, command, *args, **kwargs):
+        """Coroutine version of check_output()"""
+        from testinfra.utils import aio
+        return aio.then(self.arun(command, *args, **kwargs), self._get_output)
 
     @classmethod
     def get_module(cls, _backend):
         klass = cls.get_module_class(_backend)
-        return type(klass.__name__, (klass,), {
-            "_backend": _backend,
-        })
+        attrs = {"_backend": _backend}
+        if _backend.lazy:
+            for name in klass.probes:
+                attrs[name] = DeferredProperty(name, getattr(klass, name))
+        return type(klass.__name__, (klass,), attrs)
 
     @classmethod
     def get_module_class(cls, _backend):
@@ -36,11 +36,42 @@ class Command(InstanceModule):
         rc=2, stdout='',
         stderr='ls: cannot access /;echo inject: No such file or directory\\n',
         command="ls -l '/;echo inject'")
+
+
+    Commands can be given a timeout in seconds, the command is killed when
+    it expires:
+
+    >>> cmd = Command("sleep 60", timeout=5)
+    >>> cmd.timed_out, cmd.rc
+    (True, None)
     """
 
+    # Commands given by tests may change the host state
+    prefetchable = False
+
     def __call__(self, command, *args, **kwargs):
         return self.run(command, *args, **kwargs)
 
+    def run(self, command, *args, **kwargs):
+        # The command may change the state of the host, facts and
+        # prefetched results may not be valid after it
+        self._backend.facts.invalidate()
+        self._backend.clear_prefetched()
+        return super(Command, self).run(command, *args, **kwargs)
+
+    # Helpers below are used to read the state of the host, their commands
+    # aren't considered to change it
+
+    def run_expect(self, expected, command, *args, **kwargs):
+        __tracebackhide__ = True  # pylint: disable=unused-variable
+        return self._check_exit_status(
+            expected, super(Command, self).run(command, *args, **kwargs))
+
+    def check_output(self, command, *args, **kwargs):
+        __tracebackhide__ = True  # pylint: disable=unused-variable
+        return self._get_output(
+            super(Command, self).run(command, *args, **kwargs))
+
     def exists(self, command):
         """Return True if given command exist in $PATH"""
         return self.run_expect([0, 1, 127], "command -v %s", command).rc == 0
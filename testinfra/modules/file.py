@@ -20,6 +20,9 @@ from testinfra.modules.base import Module
 
 class File(Module):
     """Test various files attributes"""
+    probes = (
+        "exists", "is_file", "is_directory", "is_symlink", "user", "group",
+        "mode")
 
     def __init__(self, path):
         self.path = path
@@ -18,6 +18,7 @@ from testinfra.modules.base import Module
 
 class Group(Module):
     """Test unix group"""
+    probes = ("exists", "gid")
 
     def __init__(self, name=None):
         self.name = name
@@ -18,6 +18,7 @@ from testinfra.modules.base import Module
 
 class MountPoint(Module):
     """Test Mount Points"""
+    probes = ("exists",)
 
     def __init__(self, path, _attrs_cache=None):
         self.path = path
@@ -41,10 +42,16 @@ class MountPoint(Module):
         """
         return bool(self._attrs)
 
+    @classmethod
+    def _get_mountpoints(cls):
+        # Mount points of the host, read once (see the "mountpoints" fact)
+        return cls._backend.facts.get(
+            "mountpoints", lambda: list(cls._iter_mountpoints()))
+
     @property
     def _attrs(self):
         if self._attrs_cache is None:
-            for mountpoint in self._iter_mountpoints():
+            for mountpoint in self._get_mountpoints():
                 if mountpoint["path"] == self.path:
                     self._attrs_cache = mountpoint
                     break
@@ -91,7 +98,7 @@ class MountPoint(Module):
          <MountPoint(path=/, device=/dev/sda1, filesystem=ext4, options=rw,relatime,errors=remount-ro,data=ordered)>]
         """  # noqa
         mountpoints = []
-        for mountpoint in cls._iter_mountpoints():
+        for mountpoint in cls._get_mountpoints():
             mountpoints.append(cls(mountpoint["path"], mountpoint))
         return mountpoints
 
@@ -18,6 +18,7 @@ from testinfra.modules.base import Module
 
 class Package(Module):
     """Test packages status and version"""
+    probes = ("is_installed", "version")
 
     def __init__(self, name):
         self.name = name
@@ -29,6 +29,7 @@ class Service(Module):
       (``is_enabled`` is not yet implemented)
 
     """
+    probes = ("is_running", "is_enabled")
 
     def __init__(self, name):
         self.name = name
@@ -80,6 +80,7 @@ class Socket(Module):
       - udp socket on 127.0.0.1 port 69: ``udp://127.0.0.1:69``
 
     """
+    probes = ("is_listening",)
 
     def __init__(self, socketspec):
         if socketspec is not None:
@@ -14,8 +14,6 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
-import contextlib
-
 from testinfra.modules.base import InstanceModule
 
 
@@ -34,20 +32,10 @@ class Sudo(InstanceModule):
     'root'
     'www-data'
 
+    Sudo only applies to commands run by the current thread.
     """
-    @contextlib.contextmanager
     def __call__(self, user=None):
-        old_get_command = self._backend.get_command
-        quote = self._backend.quote
-        get_sudo_command = self._backend.get_sudo_command
-
-        def get_command(command, *args):
-            return old_get_command(
-                get_sudo_command(quote(command, *args), user))
-
-        self._backend.get_command = get_command
-        yield
-        self._backend.get_command = old_get_command
+        return self._backend.sudo_context(user)
 
     def __repr__(self):
         return "<sudo>"
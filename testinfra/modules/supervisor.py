@@ -31,6 +31,7 @@ class Supervisor(Module):
     >>> gunicorn.pid
     4242
     """
+    probes = ("status", "pid")
 
     def __init__(self, name, _attrs_cache=None):
         self.name = name
@@ -58,13 +59,17 @@ class Supervisor(Module):
             pid = None
         return {"name": name, "status": status, "pid": pid}
 
+    def _get_attrs(self):
+        line = self.check_output("supervisorctl status %s", self.name)
+        attrs = self._parse_status(line)
+        assert attrs["name"] == self.name
+        return attrs
+
     @property
     def _attrs(self):
         if self._attrs_cache is None:
-            line = self.check_output("supervisorctl status %s", self.name)
-            attrs = self._parse_status(line)
-            assert attrs["name"] == self.name
-            self._attrs_cache = attrs
+            self._attrs_cache = self._backend.facts.get(
+                ("supervisor", self.name), self._get_attrs)
         return self._attrs_cache
 
     @property
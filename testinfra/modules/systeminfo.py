@@ -14,6 +14,7 @@
 from __future__ import unicode_literals
 
 import re
+import threading
 
 from testinfra.modules.base import InstanceModule
 
@@ -23,12 +24,15 @@ class SystemInfo(InstanceModule):
 
     def __init__(self):
         self._sysinfo = None
+        self._lock = threading.Lock()
         super(SystemInfo, self).__init__()
 
     @property
     def sysinfo(self):
         if self._sysinfo is None:
-            self._sysinfo = self.get_system_info()
+            with self._lock:
+                if self._sysinfo is None:
+                    self._sysinfo = self.get_system_info()
         return self._sysinfo
 
     def _get_linux_sysinfo(self):
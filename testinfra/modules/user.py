@@ -23,6 +23,7 @@ class User(Module):
 
     If name is not supplied, test the current user
     """
+    probes = ("exists", "uid", "gid", "group", "home", "shell")
 
     def __init__(self, name=None):
         self._name = name
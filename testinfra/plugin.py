@@ -15,10 +15,18 @@
 from __future__ import unicode_literals
 
 import logging
+import os
+import warnings
 
 import pytest
 import testinfra
 from testinfra import modules
+from testinfra import selection
+from testinfra import shard
+
+# Maximum number of hosts run concurrently by --testinfra-adaptive without
+# --testinfra-workers
+ADAPTIVE_MAX_WORKERS = 256
 
 File = modules.File.as_fixture()
 Command = modules.Command.as_fixture()
@@ -106,30 +114,499 @@ def pytest_addoption(parser):
         dest="nagios",
         help="Nagios plugin",
     )
+    group.addoption(
+        "--nagios-warning",
+        action="store",
+        dest="nagios_warning",
+        type=float,
+        help="Nagios WARNING threshold on total run time (seconds)",
+    )
+    group.addoption(
+        "--nagios-critical",
+        action="store",
+        dest="nagios_critical",
+        type=float,
+        help="Nagios CRITICAL threshold on total run time (seconds)",
+    )
+    group.addoption(
+        "--daemon",
+        action="store_true",
+        dest="daemon",
+        help="Run tests periodically and serve the latest results",
+    )
+    group.addoption(
+        "--daemon-interval",
+        action="store",
+        dest="daemon_interval",
+        type=float,
+        default=60,
+        help="Interval between two runs in daemon mode (default: 60)",
+    )
+    group.addoption(
+        "--daemon-listen",
+        action="store",
+        dest="daemon_listen",
+        help=(
+            "Address serving results in daemon mode "
+            "(unix:///path/to/socket or http://host:port)"
+        ),
+    )
+    group.addoption(
+        "--daemon-query",
+        action="store",
+        dest="daemon_query",
+        help="Print the latest results of a daemon (nagios plugin output)",
+    )
+    group.addoption(
+        "--history-db",
+        action="store",
+        dest="history_db",
+        help=(
+            "Record tests and commands timings in this SQLite database "
+            "(see testinfra-history)"
+        ),
+    )
+    group.addoption(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        help=(
+            "Skip tests which passed on hosts unchanged since then "
+            "(uses pytest cache)"
+        ),
+    )
+    group.addoption(
+        "--testinfra-workers",
+        action="store",
+        dest="testinfra_workers",
+        type=int,
+        default=1,
+        help="Run tests of different hosts concurrently in N threads",
+    )
+    group.addoption(
+        "--testinfra-prefetch",
+        action="store_true",
+        dest="testinfra_prefetch",
+        help=(
+            "Run commands of test files recorded in the previous run in a "
+            "single batch when they start on a host"
+        ),
+    )
+    group.addoption(
+        "--testinfra-lazy",
+        action="store_true",
+        dest="testinfra_lazy",
+        help=(
+            "Evaluate main properties of modules when they are used, "
+            "values created before are evaluated in batches of commands"
+        ),
+    )
+    group.addoption(
+        "--testinfra-locality",
+        action="store_true",
+        dest="testinfra_locality",
+        help=(
+            "Run tests grouped by host, then by file and by modules used, so "
+            "connections and caches of a host are used while warm"
+        ),
+    )
+    group.addoption(
+        "--testinfra-adaptive",
+        action="store_true",
+        dest="testinfra_adaptive",
+        help=(
+            "Tune the number of hosts run concurrently from the latency and "
+            "errors of commands, up to --testinfra-workers (default %d)"
+        ) % (ADAPTIVE_MAX_WORKERS,),
+    )
+    group.addoption(
+        "--testinfra-preflight",
+        action="store",
+        dest="testinfra_preflight",
+        choices=["skip", "fail"],
+        help=(
+            "Check all hosts concurrently before running tests and skip or "
+            "fail tests of unreachable hosts"
+        ),
+    )
+    group.addoption(
+        "--testinfra-preflight-timeout",
+        action="store",
+        dest="testinfra_preflight_timeout",
+        type=float,
+        default=30,
+        help="Consider hosts unreachable after this delay (default: 30)",
+    )
+    group.addoption(
+        "--testinfra-warmup",
+        action="store",
+        dest="testinfra_warmup",
+        type=int,
+        default=0,
+        help=(
+            "Connect to hosts and discover their facts in N threads while "
+            "tests are collected"
+        ),
+    )
+    group.addoption(
+        "--testinfra-command-timeout",
+        action="store",
+        dest="testinfra_command_timeout",
+        type=float,
+        help=(
+            "Default timeout of commands in seconds, commands still running "
+            "are killed and their result has timed_out set"
+        ),
+    )
+    group.addoption(
+        "--testinfra-max-commands",
+        action="store",
+        dest="testinfra_max_commands",
+        type=int,
+        help="Maximum number of commands running at the same time on a host",
+    )
+    group.addoption(
+        "--testinfra-command-rate",
+        action="store",
+        dest="testinfra_command_rate",
+        type=float,
+        help="Maximum number of commands started per second on a host",
+    )
+    group.addoption(
+        "--testinfra-max-connecting",
+        action="store",
+        dest="testinfra_max_connecting",
+        type=int,
+        help=(
+            "Maximum number of connections being established at the same "
+            "time (paramiko and asyncssh backends)"
+        ),
+    )
+    group.addoption(
+        "--testinfra-max-connections",
+        action="store",
+        dest="testinfra_max_connections",
+        type=int,
+        help=(
+            "Maximum number of open connections, least recently used idle "
+            "connections are closed and reopened when needed"
+        ),
+    )
+    group.addoption(
+        "--testinfra-fleet",
+        action="store",
+        dest="testinfra_fleet",
+        help=(
+            "Run tests host by host for hosts read from this file, one per "
+            "line (- for stdin)"
+        ),
+    )
+    group.addoption(
+        "--testinfra-shard",
+        action="store",
+        dest="testinfra_shard",
+        type=shard.parse_shard,
+        help="Only test the i-th of N parts of hosts (i/N)",
+    )
+    group.addoption(
+        "--testinfra-shard-durations",
+        action="store",
+        dest="testinfra_shard_durations",
+        help=(
+            "Balance shards using hosts durations from this JSON file "
+            "(.pytest_cache/v/testinfra/durations of a previous run)"
+        ),
+    )
+    group.addoption(
+        "--testinfra-broker",
+        action="store_true",
+        dest="testinfra_broker",
+        help=(
+            "Share connections and facts of hosts between pytest-xdist "
+            "workers through a broker process"
+        ),
+    )
+
+
+def pytest_addhooks(pluginmanager):
+    from testinfra import hookspecs
+    pluginmanager.add_hookspecs(hookspecs)
+
+
+def get_backend_kwargs(config):
+    """Return backend options given on the command line"""
+    return dict(
+        connection=config.option.connection,
+        ssh_config=config.option.ssh_config,
+        sudo=config.option.sudo,
+        sudo_user=config.option.sudo_user,
+        ansible_inventory=config.option.ansible_inventory,
+        timeout=config.option.testinfra_command_timeout,
+        max_commands=config.option.testinfra_max_commands,
+        command_rate=config.option.testinfra_command_rate,
+        lazy=config.option.testinfra_lazy,
+    )
 
 
 def pytest_generate_tests(metafunc):
     if "_testinfra_backend" in metafunc.fixturenames:
+        if metafunc.config.option.testinfra_fleet is not None:
+            # Backends are set for each host by the Fleet plugin
+            from testinfra import fleet
+            metafunc.parametrize(
+                "_testinfra_backend", [None], ids=[fleet.FLEET_ID],
+                scope="module")
+            return
         if metafunc.config.option.hosts is not None:
             hosts = metafunc.config.option.hosts.split(",")
         elif hasattr(metafunc.module, "testinfra_hosts"):
             hosts = metafunc.module.testinfra_hosts
         else:
             hosts = [None]
-        params = testinfra.get_backends(
-            hosts,
-            connection=metafunc.config.option.connection,
-            ssh_config=metafunc.config.option.ssh_config,
-            sudo=metafunc.config.option.sudo,
-            sudo_user=metafunc.config.option.sudo_user,
-            ansible_inventory=metafunc.config.option.ansible_inventory,
-        )
+        kwargs = get_backend_kwargs(metafunc.config)
+        broker_path = os.environ.get("TESTINFRA_BROKER")
+        if broker_path:
+            from testinfra import broker
+            params = broker.get_backends(broker_path, hosts, **kwargs)
+        else:
+            params = testinfra.get_backends(hosts, **kwargs)
+        if metafunc.config.option.testinfra_shard is not None:
+            durations = None
+            if metafunc.config.option.testinfra_shard_durations:
+                durations = shard.load_durations(
+                    metafunc.config.option.testinfra_shard_durations)
+            params = shard.select(
+                params, metafunc.config.option.testinfra_shard, durations)
+        markers = selection.get_markers(
+            getattr(metafunc, "definition", metafunc))
+        if markers:
+            params = selection.select(params, markers)
+        warmup = metafunc.config.pluginmanager.get_plugin("testinfra-warmup")
+        if warmup is not None:
+            warmup.submit(params)
         ids = [e.get_pytest_id() for e in params]
         metafunc.parametrize(
             "_testinfra_backend", params, ids=ids, scope="module")
 
 
+def get_item_backend(item):
+    """Return the backend a test item is parametrized with or None"""
+    callspec = getattr(item, "callspec", None)
+    if callspec is None:
+        return None
+    return callspec.params.get("_testinfra_backend")
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    outcome = yield
+    backend = get_item_backend(item)
+    if backend is not None:
+        # Serialized with the report by pytest-xdist
+        outcome.get_result().testinfra_host = backend.get_pytest_id()
+
+
+def sort_by_locality(items):
+    """Return items grouped by host, then by file, then by modules used
+
+    Groups are ordered by their first item so the order is stable and
+    items of a group keep their collection order.
+    """
+    groups = {}
+
+    def index(key):
+        return groups.setdefault(key, len(groups))
+
+    def sort_key(position):
+        item = items[position]
+        backend = get_item_backend(item)
+        host = backend.get_pytest_id() if backend is not None else None
+        used = tuple(sorted(
+            set(getattr(item, "fixturenames", ())) & set(modules.__all__)))
+        return (
+            index(("host", host)),
+            index(("file", host, item.fspath)),
+            index(("modules", host, item.fspath, used)),
+            position,
+        )
+
+    # Compute group indexes in collection order before sorting
+    keys = [sort_key(i) for i in range(len(items))]
+    return [items[key[-1]] for key in sorted(keys)]
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    yield
+    get_marker = getattr(item, "get_closest_marker", None) or getattr(
+        item, "get_marker")
+    marker = get_marker("testinfra_invalidate")
+    backend = get_item_backend(item)
+    if backend is not None:
+        backend.discard_deferred()
+    if marker is not None and backend is not None:
+        backend.facts.invalidate(*marker.args)
+        backend.clear_prefetched()
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(config, items):
+    if config.option.testinfra_locality:
+        items[:] = sort_by_locality(items)
+    # Before pytest-xdist adds the group to nodeids (--dist loadgroup)
+    if getattr(config.option, "loadgroup", False):
+        for item in items:
+            backend = get_item_backend(item)
+            if backend is not None:
+                item.add_marker(pytest.mark.xdist_group(
+                    backend.get_pytest_id()))
+        return
+    workerinput = getattr(config, "workerinput", None)
+    if workerinput is not None and workerinput.get("workerid") == "gw0" and (
+        workerinput.get("testinfra_dist") == "load"
+    ) and any(get_item_backend(item) is not None for item in items):
+        warnings.warn(getattr(pytest, "PytestWarning", UserWarning)(
+            "Tests of a host are sent to any pytest-xdist worker, use "
+            "--dist loadgroup to keep them on the same worker"))
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    # Workers only know the distribution mode given on the command line
+    node.workerinput["testinfra_dist"] = node.config.getvalue("dist")
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_xdist_make_scheduler(config, log):
+    from testinfra import scheduling
+    if config.getvalue("dist") != "loadgroup" or not (
+        scheduling.HAS_LOADGROUP
+    ):
+        return None
+    return scheduling.HostScheduling(
+        config, log,
+        durations=config.pluginmanager.get_plugin("testinfra-durations"))
+
+
+def pytest_terminal_summary(terminalreporter):
+    from testinfra.backend import base
+    if not base.limits.queued:
+        return
+    terminalreporter.section("testinfra queued commands")
+    hosts = sorted(
+        base.limits.queued.items(), key=lambda x: x[1][1], reverse=True)
+    for host, (count, queued) in hosts[:10]:
+        terminalreporter.write_line(
+            "%.2fs %s (%d commands)" % (queued, host, count))
+
+
 def pytest_configure(config):
+    config.addinivalue_line(
+        "markers",
+        "testinfra_invalidate(*facts): forget facts of the host (all facts "
+        "by default) after the test, for tests changing the host state")
+    config.addinivalue_line(
+        "markers",
+        "testinfra_select(*predicates, **facts): only run the test on hosts "
+        "matching SystemInfo facts and predicates called with the backend")
+    workerinput = getattr(config, "workerinput", None)
+    if workerinput is not None:
+        # Workers parse the command line again, see below
+        if workerinput.get("testinfra_dist") == "loadgroup":
+            config.option.loadgroup = True
+    elif getattr(config.option, "dist", None) == "load" and (
+        config.option.hosts is not None
+    ):
+        from testinfra import scheduling
+        if scheduling.HAS_LOADGROUP:
+            # Tests are parametrized with hosts, keep tests of a host on the
+            # same worker (see pytest_xdist_make_scheduler())
+            config.option.dist = "loadgroup"
     if config.option.verbose > 1:
         logging.basicConfig()
         logging.getLogger("testinfra").setLevel(logging.DEBUG)
+    if getattr(config, "cache", None) is not None:
+        from testinfra import scheduling
+        config.pluginmanager.register(
+            scheduling.HostDurations(config), "testinfra-durations")
+    if config.option.daemon:
+        if config.option.daemon_listen is None:
+            raise pytest.UsageError("--daemon requires --daemon-listen")
+        if config.option.testinfra_workers > 1 or (
+            config.option.testinfra_adaptive
+        ):
+            raise pytest.UsageError(
+                "--daemon cannot be used with --testinfra-workers or "
+                "--testinfra-adaptive")
+        from testinfra import daemon
+        config.pluginmanager.register(
+            daemon.Daemon(config), "testinfra-daemon")
+    if config.option.history_db:
+        from testinfra import history
+        config.pluginmanager.register(
+            history.HistoryStore(config.option.history_db),
+            "testinfra-history")
+    if config.option.incremental:
+        if getattr(config, "cache", None) is None:
+            raise pytest.UsageError("--incremental requires the cacheprovider")
+        from testinfra import incremental
+        config.pluginmanager.register(
+            incremental.Incremental(config), "testinfra-incremental")
+    if config.option.testinfra_preflight is not None:
+        from testinfra import preflight
+        config.pluginmanager.register(preflight.Preflight(
+            config.option.testinfra_preflight,
+            config.option.testinfra_preflight_timeout,
+        ), "testinfra-preflight")
+    if config.option.testinfra_prefetch:
+        if getattr(config, "cache", None) is None:
+            raise pytest.UsageError(
+                "--testinfra-prefetch requires the cacheprovider")
+        from testinfra import prefetch
+        config.pluginmanager.register(
+            prefetch.Prefetch(config), "testinfra-prefetch")
+    if config.option.testinfra_warmup > 0:
+        from testinfra import warmup
+        config.pluginmanager.register(
+            warmup.Warmup(config.option.testinfra_warmup), "testinfra-warmup")
+    if config.option.testinfra_max_connections is not None:
+        from testinfra.backend import base
+        base.connections.maximum = config.option.testinfra_max_connections
+    if config.option.testinfra_max_connecting is not None:
+        from testinfra.backend import base
+        base.limits.max_connecting = config.option.testinfra_max_connecting
+    if config.option.testinfra_fleet is not None:
+        if config.option.hosts is not None:
+            raise pytest.UsageError(
+                "--testinfra-fleet and --hosts are mutually exclusive")
+        if config.option.daemon or config.option.testinfra_workers > 1 or (
+            config.option.testinfra_adaptive
+        ):
+            raise pytest.UsageError(
+                "--testinfra-fleet cannot be used with --daemon or "
+                "--testinfra-workers")
+        from testinfra import fleet
+        # The number of tests is unknown, don't show a progress percentage
+        config.option.console_output_style = "classic"
+        config.pluginmanager.register(fleet.Fleet(config), "testinfra-fleet")
+    if config.option.testinfra_broker and not os.environ.get(
+        "TESTINFRA_BROKER"
+    ):
+        # Workers inherit the broker of the controller from environment
+        from testinfra import broker
+        broker_process = broker.BrokerProcess()
+        broker_process.start()
+        config.pluginmanager.register(broker_process, "testinfra-broker")
+    if config.option.testinfra_adaptive:
+        from testinfra import executor
+        workers = config.option.testinfra_workers
+        config.pluginmanager.register(
+            executor.ParallelExecutor(
+                workers if workers > 1 else ADAPTIVE_MAX_WORKERS,
+                adaptive=True),
+            "testinfra-executor")
+    elif config.option.testinfra_workers > 1:
+        from testinfra import executor
+        config.pluginmanager.register(
+            executor.ParallelExecutor(config.option.testinfra_workers),
+            "testinfra-executor")
@@ -0,0 +1,127 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Prefetch commands of test modules recorded in previous runs
+
+Commands run by testinfra modules (which only read the state of hosts) are
+recorded per test file and class of host, and stored in the pytest cache.
+When the tests of a file start on a host, the commands recorded in the
+previous run are sent in a single batch (see BaseBackend.run_many()) and
+modules use the prefetched results instead of running them again.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import logging
+
+import pytest
+
+from testinfra.plugin import get_item_backend
+
+logger = logging.getLogger("testinfra")
+
+CACHE_PREFIX = "testinfra/prefetch/"
+
+
+def get_module_id(item):
+    """Return the test file of an item"""
+    return item.nodeid.split("::", 1)[0]
+
+
+class Prefetch(object):
+    """pytest plugin prefetching commands of test files"""
+
+    def __init__(self, config):
+        self.config = config
+        # id(backend) -> (test file, cache key or None, prefetched_used)
+        self.current = {}
+        self.prefetched = 0
+        self.used = 0
+        super(Prefetch, self).__init__()
+
+    @staticmethod
+    def get_host_class(backend):
+        """Return what commands of a test file depend on for a host"""
+        sysinfo = backend.get_module("SystemInfo").sysinfo
+        return [
+            backend.sudo, backend.sudo_user, sysinfo["type"],
+            sysinfo["distribution"], sysinfo["release"]]
+
+    def get_cache_key(self, module_id, backend):
+        try:
+            host_class = self.get_host_class(backend)
+        except (Exception, pytest.fail.Exception) as exc:
+            # Tests of the host will report the error
+            logger.debug("Cannot prefetch commands of %s: %s", (
+                backend.get_pytest_id()), exc)
+            return None
+        key = json.dumps([module_id, host_class], sort_keys=True)
+        return CACHE_PREFIX + hashlib.md5(key.encode("utf-8")).hexdigest()
+
+    def start(self, module_id, backend):
+        key = self.get_cache_key(module_id, backend)
+        self.current[id(backend)] = (
+            module_id, key, backend.prefetched_used)
+        if key is None:
+            return
+        commands = self.config.cache.get(key, None)
+        if commands:
+            try:
+                backend.prefetch_commands(commands)
+            except Exception as exc:  # pylint: disable=broad-except
+                # Commands will run normally
+                logger.debug("Prefetch failed on %s: %s", (
+                    backend.get_pytest_id()), exc)
+            else:
+                self.prefetched += len(commands)
+        backend.recorded_commands = []
+
+    def finish(self, backend):
+        _, key, used = self.current.pop(id(backend))
+        recorded, backend.recorded_commands = backend.recorded_commands, None
+        # Results discarded by commands changing the host aren't used either
+        backend.clear_prefetched()
+        self.used += backend.prefetched_used - used
+        if key is not None and recorded is not None:
+            self.config.cache.set(key, recorded)
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_setup(self, item):
+        # Before fixtures of the item are set up
+        backend = get_item_backend(item)
+        if backend is None:
+            return
+        module_id = get_module_id(item)
+        current = self.current.get(id(backend))
+        if current is not None and current[0] == module_id:
+            return
+        if current is not None:
+            self.finish(backend)
+        self.start(module_id, backend)
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_runtest_teardown(self, item, nextitem):
+        backend = get_item_backend(item)
+        if backend is None or id(backend) not in self.current:
+            return
+        if nextitem is None or get_item_backend(nextitem) is not backend or (
+            get_module_id(nextitem) != get_module_id(item)
+        ):
+            self.finish(backend)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.prefetched:
+            terminalreporter.write_sep("-", (
+                "testinfra prefetch: %d commands prefetched, %d used") % (
+                    self.prefetched, self.used))
@@ -0,0 +1,134 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Check that hosts are reachable before running tests
+
+All hosts are checked concurrently once the tests are collected, tests of
+unreachable hosts are then skipped (or failed) without waiting for a
+connection timeout in each of them.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import logging
+import threading
+import time
+
+import pytest
+
+from testinfra.plugin import get_item_backend
+
+logger = logging.getLogger("testinfra")
+
+# Maximum number of hosts checked at the same time
+CONCURRENCY = 100
+
+
+def check(backend):
+    """Return None if the host is reachable or the reason why it isn't"""
+    try:
+        out = backend.run("true")
+    except Exception as exc:  # pylint: disable=broad-except
+        return "%s: %s" % (type(exc).__name__, exc)
+    if out.rc != 0:
+        return "exit status %s: %s" % (out.rc, out.stderr.strip())
+    return None
+
+
+class Preflight(object):
+    """pytest plugin skipping or failing tests of unreachable hosts"""
+
+    def __init__(self, action, timeout, concurrency=CONCURRENCY):
+        self.action = action
+        self.timeout = timeout
+        self.concurrency = concurrency
+        # pytest id -> reason, cached for the session
+        self.unreachable = collections.OrderedDict()
+        self.done = threading.Condition()
+        super(Preflight, self).__init__()
+
+    def _check(self, backend, results):
+        reason = check(backend)
+        with self.done:
+            results[backend] = reason
+            self.done.notify_all()
+
+    def check_all(self, backends):
+        """Return {backend: reason} of unreachable backends"""
+        pending = collections.deque(backends)
+        # backend -> start time
+        running = {}
+        results = {}
+        unreachable = {}
+        with self.done:
+            while pending or running:
+                now = time.time()
+                for backend, start in list(running.items()):
+                    if backend in results:
+                        del running[backend]
+                        if results[backend] is not None:
+                            unreachable[backend] = results[backend]
+                    elif now - start > self.timeout:
+                        # abandon the thread, it is a daemon
+                        del running[backend]
+                        unreachable[backend] = (
+                            "no response after %s seconds" % (self.timeout,))
+                while pending and len(running) < self.concurrency:
+                    backend = pending.popleft()
+                    thread = threading.Thread(
+                        target=self._check, args=(backend, results))
+                    thread.daemon = True
+                    running[backend] = time.time()
+                    thread.start()
+                if running:
+                    self.done.wait(.1)
+        return unreachable
+
+    def pytest_collection_modifyitems(self, items):
+        backends = collections.OrderedDict()
+        for item in items:
+            backend = get_item_backend(item)
+            if backend is not None:
+                backends.setdefault(backend.get_pytest_id(), backend)
+        backends = [
+            b for host, b in backends.items() if host not in self.unreachable]
+        start = time.time()
+        for backend, reason in self.check_all(backends).items():
+            self.unreachable[backend.get_pytest_id()] = reason
+        logger.debug(
+            "Checked %d hosts in %.3f seconds", len(backends),
+            time.time() - start)
+        for item in items:
+            backend = get_item_backend(item)
+            if backend is None:
+                continue
+            reason = self.unreachable.get(backend.get_pytest_id())
+            if reason is not None and self.action == "skip":
+                item.add_marker(pytest.mark.skip(
+                    reason="host unreachable (%s)" % (reason,)))
+
+    def pytest_runtest_setup(self, item):
+        backend = get_item_backend(item)
+        if backend is None or self.action != "fail":
+            return
+        reason = self.unreachable.get(backend.get_pytest_id())
+        if reason is not None:
+            pytest.fail(
+                "%s unreachable (%s)" % (backend.get_pytest_id(), reason),
+                pytrace=False)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.unreachable:
+            terminalreporter.section("unreachable hosts")
+            for host, reason in self.unreachable.items():
+                terminalreporter.write_line("%s: %s" % (host, reason))
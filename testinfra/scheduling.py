@@ -0,0 +1,105 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Keep tests of a host on the same pytest-xdist worker
+
+With ``--dist loadgroup``, items are marked with a ``xdist_group`` per host
+and HostScheduling sends the hosts to workers by decreasing expected
+duration, estimated from the previous runs.
+"""
+
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+try:
+    from xdist.scheduler import LoadGroupScheduling
+except ImportError:
+    HAS_LOADGROUP = False
+else:
+    HAS_LOADGROUP = True
+
+CACHE_KEY = "testinfra/durations"
+
+
+class HostDurations(object):
+    """pytest plugin keeping the mean duration of tests of each host
+
+    Durations of the last run are stored in the pytest cache.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        # pytest id -> [mean test duration, number of tests]
+        self.durations = config.cache.get(CACHE_KEY, {})
+        # pytest id -> [total duration, number of tests] of this run
+        self.current = {}
+        super(HostDurations, self).__init__()
+
+    def get_expected_duration(self, host, count):
+        """Return the expected duration of `count` tests of a host
+
+        Hosts without history are expected to be as slow as the mean host.
+        Return None when nothing is known.
+        """
+        if host in self.durations:
+            return self.durations[host][0] * count
+        elif self.durations:
+            means = [mean for mean, _ in self.durations.values()]
+            return sum(means) / len(means) * count
+        return None
+
+    def pytest_runtest_logreport(self, report):
+        host = getattr(report, "testinfra_host", None)
+        if host is None:
+            return
+        stats = self.current.setdefault(host, [0., 0])
+        stats[0] += report.duration
+        if report.when == "setup":
+            stats[1] += 1
+
+    def pytest_sessionfinish(self):
+        # Only the controller of pytest-xdist workers write the cache
+        if not self.current or hasattr(self.config, "workerinput"):
+            return
+        for host, (total, count) in self.current.items():
+            if count:
+                self.durations[host] = [total / count, count]
+        self.config.cache.set(CACHE_KEY, self.durations)
+
+
+if HAS_LOADGROUP:
+
+    class HostScheduling(LoadGroupScheduling):
+        """Schedule whole hosts, longest first"""
+
+        def __init__(self, config, log=None, durations=None):
+            self.durations = durations
+            self._sorted = False
+            super(HostScheduling, self).__init__(config, log)
+
+        def get_expected_duration(self, scope, work_unit):
+            duration = None
+            if self.durations is not None:
+                duration = self.durations.get_expected_duration(
+                    scope, len(work_unit))
+            return len(work_unit) if duration is None else duration
+
+        def _assign_work_unit(self, node):
+            # called once the work queue is complete
+            if not self._sorted:
+                self._sorted = True
+                units = sorted(
+                    self.workqueue.items(),
+                    key=lambda unit: -self.get_expected_duration(*unit))
+                self.workqueue.clear()
+                self.workqueue.update(units)
+            super(HostScheduling, self)._assign_work_unit(node)
@@ -0,0 +1,126 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Select the hosts of tests from their facts at collection time
+
+::
+
+    @pytest.mark.testinfra_select(distribution=["debian", "ubuntu"])
+    def test_apt(Package):
+        [...]
+
+    pytestmark = pytest.mark.testinfra_select(
+        lambda host: host.Command.exists("docker"))
+
+Keyword arguments are matched against SystemInfo facts (type,
+distribution, codename, release) and can be a value, a list of values or a
+predicate called with the fact. Positional arguments are predicates called
+with the backend. Tests are only parametrized with hosts matching all the
+testinfra_select markers applying to them.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import threading
+
+import pytest
+from six.moves import queue
+
+logger = logging.getLogger("testinfra")
+
+MARKER = "testinfra_select"
+# Maximum number of hosts probed at the same time
+CONCURRENCY = 100
+
+
+def get_markers(node):
+    """Return testinfra_select markers of a test item or definition"""
+    iter_markers = getattr(node, "iter_markers", None)
+    if iter_markers is not None:
+        return list(iter_markers(MARKER))
+    # pytest < 3.6
+    marker = getattr(getattr(node, "function", None), MARKER, None)
+    return [marker] if marker is not None else []
+
+
+def _match(value, expected):
+    if callable(expected):
+        return expected(value)
+    elif isinstance(expected, (list, tuple, set, frozenset)):
+        return value in expected
+    return value == expected
+
+
+def matches(backend, markers):
+    """Return True if the host of backend matches all markers
+
+    Results of predicates are kept in the facts of the host.
+    """
+    for marker in markers:
+        for predicate in marker.args:
+            if not backend.facts.get((MARKER, predicate), predicate, backend):
+                return False
+        if marker.kwargs:
+            sysinfo = backend.get_module("SystemInfo").sysinfo
+            for key, expected in marker.kwargs.items():
+                if not _match(sysinfo.get(key), expected):
+                    return False
+    return True
+
+
+def matches_item(backend, item):
+    """Return True if a test item must run on the host of backend"""
+    markers = get_markers(item)
+    if not markers:
+        return True
+    try:
+        return matches(backend, markers)
+    except (Exception, pytest.fail.Exception) as exc:
+        logger.debug("Cannot select %s: %s", backend.get_pytest_id(), exc)
+        return True
+
+
+def select(backends, markers, concurrency=CONCURRENCY):
+    """Return backends matching markers, hosts are probed concurrently
+
+    Hosts which cannot be probed are kept so their tests report the error.
+    """
+    backends = list(backends)
+    if not markers or not backends:
+        return backends
+    results = [True] * len(backends)
+    tasks = queue.Queue()
+    for i in range(len(backends)):
+        tasks.put(i)
+
+    def worker():
+        while True:
+            try:
+                i = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[i] = matches(backends[i], markers)
+            except (Exception, pytest.fail.Exception) as exc:
+                logger.debug("Cannot select %s: %s", (
+                    backends[i].get_pytest_id()), exc)
+
+    threads = [
+        threading.Thread(target=worker)
+        for _ in range(min(concurrency, len(backends)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [b for b, selected in zip(backends, results) if selected]
@@ -0,0 +1,88 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Split hosts between CI nodes
+
+    $ testinfra --hosts=... --testinfra-shard=1/20  # on the first node
+    $ testinfra --hosts=... --testinfra-shard=20/20  # on the last one
+
+Hosts are assigned by a stable hash of their pytest id. With durations of a
+previous run, hosts are instead balanced by expected duration (longest host
+to the least loaded shard), which only depends on the hosts list and the
+durations so all nodes compute the same partition.
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import io
+import json
+import zlib
+
+# path -> durations
+_DURATIONS_CACHE = {}
+
+
+def parse_shard(value):
+    """Parse "i/N" (1 <= i <= N) to a (i - 1, N) tuple
+
+    >>> parse_shard("2/20")
+    (1, 20)
+    """
+    try:
+        index, count = [int(v) for v in value.split("/")]
+    except ValueError:
+        index = count = 0
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            "invalid shard '%s', expected i/N with 1 <= i <= N" % (value,))
+    return index - 1, count
+
+
+def get_shard(pytest_id, count):
+    """Return the shard (0 to count - 1) of a host"""
+    return (zlib.crc32(pytest_id.encode("utf-8")) & 0xffffffff) % count
+
+
+def load_durations(path):
+    """Return host durations from a JSON file
+
+    The format is the same as the testinfra/durations entry of the pytest
+    cache: {pytest id: [mean test duration, number of tests]}
+    """
+    if path not in _DURATIONS_CACHE:
+        with io.open(path, encoding="utf-8") as f:
+            _DURATIONS_CACHE[path] = dict(
+                (host, mean * count)
+                for host, (mean, count) in json.load(f).items())
+    return _DURATIONS_CACHE[path]
+
+
+def select(backends, shard, durations=None):
+    """Return backends of the shard (index, count)"""
+    index, count = shard
+    if not durations:
+        return [
+            b for b in backends
+            if get_shard(b.get_pytest_id(), count) == index]
+    default = sum(durations.values()) / len(durations)
+    hosts = sorted(
+        set(b.get_pytest_id() for b in backends),
+        key=lambda host: (-durations.get(host, default), host))
+    loads = [0.] * count
+    selected = set()
+    for host in hosts:
+        shard_index = min(range(count), key=lambda i: (loads[i], i))
+        loads[shard_index] += durations.get(host, default)
+        if shard_index == index:
+            selected.add(host)
+    return [b for b in backends if b.get_pytest_id() in selected]
@@ -11,7 +11,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import unicode_literals
+
+import sys
+import threading
+
 import pytest
+import testinfra.backend
+from testinfra.modules.base import Deferred
 
 BACKENDS = ("ssh", "safe-ssh", "docker", "paramiko", "ansible")
 HOSTS = [backend + "://debian_jessie" for backend in BACKENDS]
@@ -78,3 +84,314 @@ def test_ansible_hosts_expand(TestinfraBackend):
     assert get_hosts(["all"]) == ["debian_jessie"]
     assert get_hosts(["testgroup"]) == ["debian_jessie"]
     assert get_hosts(["*ia*jess*"]) == ["debian_jessie"]
+
+
+def test_thread_safety():
+    # Use a backend not shared with other tests
+    backend = testinfra.backend.get_backend("local://")
+    errors = []
+
+    def worker(num):
+        try:
+            Command = backend.get_module("Command")
+            SystemInfo = backend.get_module("SystemInfo")
+            for i in range(100):
+                value = "%s-%s" % (num, i)
+                assert Command.check_output("echo %s", value) == value
+                assert SystemInfo.type == "linux"
+                with backend.sudo_context("user%s" % (num,)):
+                    assert backend.get_command("true") == (
+                        "sudo -u user%s /bin/sh -c true" % (num,))
+                assert backend.get_command("true") == "true"
+        except Exception as exc:  # pylint: disable=broad-except
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    # SystemInfo is initialized only once: "uname -s" and "lsb_release -a"
+    # or "cat /etc/os-release"
+    assert backend.command_count <= 2000 + 3
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason="requires python>=3.5")
+def test_async_api():
+    import asyncio
+    backend = testinfra.backend.get_backend("local://")
+    Command = backend.get_module("Command")
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        tasks = [
+            loop.create_task(Command.acheck_output("echo %s", str(i)))
+            for i in range(50)
+        ] + [
+            loop.create_task(backend.get_module("SystemInfo").aget("type")),
+            loop.create_task(backend.aevaluate(
+                lambda: backend.get_module("File")("/").is_directory)),
+        ]
+        loop.run_until_complete(asyncio.wait(tasks))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    assert [t.result() for t in tasks] == (
+        [str(i) for i in range(50)] + ["linux", True])
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason="requires python>=3.5")
+def test_asyncssh_backend(tmpdir, monkeypatch):
+    asyncssh = pytest.importorskip("asyncssh")
+    import asyncio
+    from testinfra.backend import base
+    from testinfra.utils import aio
+    # Commands queued for sessions are accounted in the global limits
+    monkeypatch.setattr(base, "limits", base.HostLimits())
+
+    connections = []
+
+    class Server(asyncssh.SSHServer):
+
+        def connection_made(self, conn):
+            connections.append(conn)
+
+        def begin_auth(self, username):
+            return False
+
+    key = asyncssh.generate_private_key("ssh-ed25519")
+    server = aio.run_in_loop(asyncssh.create_server(
+        Server, "127.0.0.1", 0, server_host_keys=[key],
+        process_factory=aio.asyncssh_run_process, encoding=None))
+    try:
+        port = server.sockets[0].getsockname()[1]
+        tmpdir.join("known_hosts").write("[127.0.0.1]:%s %s" % (
+            port, key.export_public_key().decode("ascii")))
+        tmpdir.join("ssh_config").write(
+            "UserKnownHostsFile %s\n" % (tmpdir.join("known_hosts"),))
+        backend = testinfra.backend.get_backend(
+            "asyncssh://127.0.0.1:%s?ssh_config=%s" % (
+                port, tmpdir.join("ssh_config")))
+        Command = backend.get_module("Command")
+        assert Command.check_output("true") == ""
+        assert Command("echo a b | grep -q %s", "a c").rc == 1
+        assert Command("echo err >&2; exit 3").stderr == "err\n"
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            results = loop.run_until_complete(asyncio.gather(*[
+                Command.acheck_output("echo %s", str(i))
+                for i in range(3 * backend.MAX_SESSIONS)
+            ]))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        assert results == [str(i) for i in range(3 * backend.MAX_SESSIONS)]
+        assert len(connections) == 1
+        # reconnect on next use
+        backend.close()
+        assert Command.check_output("echo ok") == "ok"
+        assert len(connections) == 2
+    finally:
+        server.close()
+
+
+def test_broker(tmpdir):
+    from testinfra import broker
+    path = str(tmpdir.join("broker.sock"))
+    server = broker.Broker(path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        # e.g. two pytest-xdist workers
+        backends = [
+            broker.BrokerClient(path).get_backends(
+                [None], sudo=True, sudo_user="user")[0]
+            for _ in range(2)
+        ]
+        for backend in backends:
+            assert backend.get_pytest_id() == "local"
+            assert backend.get_command("true") == (
+                "sudo -u user /bin/sh -c true")
+            backend.sudo = False
+            Command = backend.get_module("Command")
+            assert Command.check_output("echo %s", "a b") == "a b"
+            assert Command("echo err >&2; exit 3").rc == 3
+            assert backend.get_module("SystemInfo").type == "linux"
+        # a single backend, facts are discovered once
+        local, = server.backends.values()
+        assert local.command_count < 2 * 2 + 3
+        # options of backends are given to workers
+        backend, = broker.BrokerClient(path).get_backends(
+            ["local://?max_commands=3"], lazy=True)
+        assert backend.lazy and backend.max_commands == 3
+        exists = backend.get_module("File")("/etc/passwd").exists
+        assert isinstance(exists, Deferred) and exists
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def test_connections_lru():
+    from testinfra.backend import base
+    connections = base.ConnectionsLRU(maximum=2)
+
+    class Backend(object):
+        closed = 0
+
+        def close(self):
+            connections.discard(self)
+            self.closed += 1
+
+        def get_pytest_id(self):
+            return "fake"
+
+    a, b, c = Backend(), Backend(), Backend()
+    with connections.use(a):
+        pass
+    with connections.use(b):
+        with connections.use(c):
+            pass
+        # a is the least recently used
+        assert (a.closed, b.closed, c.closed) == (1, 0, 0)
+        with connections.use(a):
+            # b is in use, c is closed instead
+            assert (a.closed, b.closed, c.closed) == (1, 0, 1)
+    with connections.use(c):
+        assert (a.closed, b.closed, c.closed) == (1, 1, 1)
+
+    # close() takes the lock of the backend (which may be held by another
+    # thread waiting for connections), so connections must not be locked
+    def is_locked():
+        locked = []
+
+        def acquire():
+            locked.append(not connections._lock.acquire(False))
+            if not locked[0]:
+                connections._lock.release()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join()
+        return locked[0]
+
+    class LockingBackend(Backend):
+
+        def close(self):
+            assert not is_locked()
+            super(LockingBackend, self).close()
+
+    connections = base.ConnectionsLRU(maximum=1)
+    d = LockingBackend()
+    with connections.use(d):
+        pass
+    with connections.use(a):
+        pass
+    assert d.closed == 1
+
+
+def test_command_timeout(monkeypatch):
+    from testinfra.backend import base
+    backend = testinfra.backend.get_backend("local://?timeout=0.5")
+    Command = backend.get_module("Command")
+    out = Command("sleep 10")
+    assert out.timed_out and out.rc is None
+    out = Command("echo ok", timeout=5)
+    assert not out.timed_out and out.stdout == "ok\n"
+    # Remote commands are also killed on the host
+    monkeypatch.setattr(base, "TIMEOUT_GRACE", 0)
+    ssh = testinfra.backend.get_backend("ssh://host")
+    out = backend.run_local(ssh.get_command("echo %s", "a b", timeout=5))
+    assert (out.rc, out.stdout) == (0, "a b\n")
+    out = backend.run_local(ssh.get_command("sleep 10", timeout=0.5))
+    assert out.rc == 137
+
+
+def test_host_limits():
+    import time
+    from testinfra.backend import base
+    limits = base.HostLimits()
+    backend = testinfra.backend.get_backend(
+        "local://?max_commands=2&command_rate=1000")
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def run():
+        with limits.command(backend):
+            with lock:
+                running.append(None)
+                peak.append(len(running))
+            # Don't run commands, they would use the global limits
+            time.sleep(.1)
+            with lock:
+                running.pop()
+
+    threads = [threading.Thread(target=run) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+    count, queued = limits.queued["local"]
+    assert count == 4 and queued > 0
+    # Limits are set per backend
+    other = testinfra.backend.get_backend("local://?max_commands=1")
+    assert limits._get_host(other)[0] is not limits._get_host(backend)[0]
+    assert limits._get_host(
+        testinfra.backend.get_backend("local://")) == (None, None)
+    bucket = base.TokenBucket(10, burst=2)
+    assert [bucket.reserve() > 0 for _ in range(3)] == [False, False, True]
+
+
+def test_prefetch_context():
+    backend = testinfra.backend.get_backend("local://")
+    File = backend.get_module("File")
+    User = backend.get_module("User")
+    backend.get_module("SystemInfo").sysinfo
+    count = backend.command_count
+    with backend.prefetch(
+        File("/etc/passwd"), File("/nonexistent"), User("root"),
+    ):
+        assert backend.command_count == count + 1
+        assert File("/etc/passwd").is_file
+        assert File("/etc/passwd").mode == File("/etc/passwd").mode
+        assert not File("/nonexistent").exists
+        assert User("root").uid == 0
+        assert backend.command_count == count + 1
+        # Command may change the host, results are run again
+        assert backend.get_module("Command")("true").rc == 0
+        assert File("/etc/passwd").is_file
+        assert backend.command_count == count + 3
+    assert File("/etc/passwd").exists
+    assert backend.command_count == count + 4
+
+
+def test_lazy_backend(tmpdir):
+    backend = testinfra.backend.get_backend("local://?lazy=true")
+    File = backend.get_module("File")
+    Command = backend.get_module("Command")
+    backend.get_module("SystemInfo").sysinfo
+    count = backend.command_count
+    passwd = File("/etc/passwd")
+    values = [passwd.exists, passwd.mode, File("/nonexistent").is_file]
+    assert backend.command_count == count
+    assert values[0] and 0 < values[1] & 0o7777 <= 0o644
+    assert not values[2]
+    assert backend.command_count == count + 1
+    assert repr(values[1]) == repr(File("/etc/passwd").mode.get())
+    # Values used as soon as they are created aren't batched
+    count = backend.command_count
+    assert File("/etc/passwd").exists
+    assert File("/etc/passwd").is_file
+    assert not File("/nonexistent").exists
+    assert backend.command_count == count + 3
+    with pytest.raises(pytest.fail.Exception):
+        File("/nonexistent").user.get()
+    path = tmpdir.join("created").strpath
+    exists = File(path).exists
+    Command.check_output("touch %s", path)
+    assert not exists
+    assert File(path).exists
@@ -0,0 +1,722 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import unicode_literals
+
+import json
+
+import pytest
+
+pytest_plugins = ["pytester"]
+
+HOSTS_TEST = """
+import pytest
+
+testinfra_hosts = ["docker://host%d" % i for i in range(6)]
+
+
+@pytest.fixture(scope="module")
+def hostname(TestinfraBackend):
+    return TestinfraBackend.get_hostname()
+
+
+def test_a(TestinfraBackend, hostname):
+    assert hostname == TestinfraBackend.get_hostname()
+
+
+def test_b(TestinfraBackend, hostname):
+    assert hostname == TestinfraBackend.get_hostname()
+    assert hostname != "host3"
+"""
+
+
+def test_workers(testdir):
+    testdir.makepyfile(HOSTS_TEST)
+    result = testdir.runpytest("-v", "--testinfra-workers=4")
+    result.assert_outcomes(passed=11, failed=1)
+    # reports are in collection order
+    result.stdout.fnmatch_lines([
+        "*test_a?docker://host0? PASSED*",
+        "*test_b?docker://host0? PASSED*",
+        "*test_a?docker://host1? PASSED*",
+        "*test_b?docker://host3? FAILED*",
+        "*test_b?docker://host5? PASSED*",
+    ])
+
+
+def test_locality(testdir):
+    testdir.makepyfile(
+        test_one="""
+testinfra_hosts = ["docker://host0", "docker://host1"]
+
+def test_a(TestinfraBackend):
+    pass
+
+def test_b(Command):
+    pass
+
+def test_c(TestinfraBackend):
+    pass
+""",
+        test_two="""
+testinfra_hosts = ["docker://host0", "docker://host1"]
+
+def test_d(TestinfraBackend):
+    pass
+""")
+    result = testdir.runpytest("-v", "--testinfra-locality")
+    result.assert_outcomes(passed=8)
+    result.stdout.fnmatch_lines([
+        "*test_one.py::test_a?docker://host0? PASSED*",
+        "*test_one.py::test_c?docker://host0? PASSED*",
+        "*test_one.py::test_b?docker://host0? PASSED*",
+        "*test_two.py::test_d?docker://host0? PASSED*",
+        "*test_one.py::test_a?docker://host1? PASSED*",
+        "*test_one.py::test_c?docker://host1? PASSED*",
+        "*test_one.py::test_b?docker://host1? PASSED*",
+        "*test_two.py::test_d?docker://host1? PASSED*",
+    ])
+
+
+def test_adaptive_workers(testdir):
+    from testinfra.executor import AIMDLimiter
+    testdir.makepyfile(HOSTS_TEST)
+    result = testdir.runpytest("--testinfra-adaptive")
+    result.assert_outcomes(passed=11, failed=1)
+    result.stdout.fnmatch_lines(["*testinfra adaptive concurrency*"])
+    limiter = AIMDLimiter(maximum=10, initial=4)
+    for _ in range(4 + 5 + 6):
+        limiter.on_command(None, "true", .01, 0)
+    assert limiter.limit == 7
+    # Connection errors and latency increases reduce the limit
+    for _ in range(7):
+        limiter.on_command(None, "true", .01, 255)
+    assert limiter.limit == 4
+    for _ in range(4):
+        limiter.on_command(None, "true", 1, 0)
+    assert limiter.limit == 2
+
+
+def test_fleet(testdir):
+    testdir.makepyfile(HOSTS_TEST)
+    testdir.makeconftest("""
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def session_fixture():
+    with open("session.log", "a") as f:
+        f.write("setup\\n")
+""")
+    testdir.makefile(".txt", hosts="""
+# comment
+docker://host2
+docker://host3
+""")
+    result = testdir.runpytest("-v", "--testinfra-fleet=hosts.txt")
+    result.assert_outcomes(passed=3, failed=1)
+    result.stdout.fnmatch_lines([
+        "*test_a?docker://host2? PASSED*",
+        "*test_b?docker://host2? PASSED*",
+        "*test_a?docker://host3? PASSED*",
+        "*test_b?docker://host3? FAILED*",
+    ])
+    # session fixtures are kept between hosts
+    assert testdir.tmpdir.join("session.log").read() == "setup\n"
+
+
+def test_xdist_host_affinity(testdir):
+    pytest.importorskip("xdist")
+    testdir.makepyfile(test_hosts="""
+import os
+import time
+
+testinfra_hosts = ["docker://host%d" % i for i in range(4)]
+
+
+def test_a(TestinfraBackend):
+    hostname = TestinfraBackend.get_hostname()
+    with open("workers.log", "a") as f:
+        f.write("%s %s\\n" % (hostname, os.environ["PYTEST_XDIST_WORKER"]))
+    # host3 is the slowest
+    time.sleep(.05 * int(hostname[-1]))
+
+test_b = test_c = test_a
+""")
+    hosts = "--hosts=" + ",".join("docker://host%d" % i for i in range(4))
+    # second run is scheduled with durations of the first one, with
+    # --hosts tests are always parametrized and loadgroup is the default
+    for args in [["--dist", "loadgroup"], [hosts]]:
+        result = testdir.runpytest("-n", "2", *args)
+        result.assert_outcomes(passed=12)
+        workers = {}
+        first = {}
+        log = testdir.tmpdir.join("workers.log")
+        for line in log.readlines():
+            host, worker = line.split()
+            workers.setdefault(host, set()).add(worker)
+            first.setdefault(worker, host)
+        log.remove()
+        assert sorted(workers) == ["host%d" % i for i in range(4)]
+        assert all(len(w) == 1 for w in workers.values())
+    durations = testdir.tmpdir.join(
+        ".pytest_cache", "v", "testinfra", "durations").read()
+    assert "docker://host3" in durations
+    # longest hosts first
+    assert sorted(first.values()) == ["host2", "host3"]
+    result = testdir.runpytest("-n", "2")
+    result.assert_outcomes(passed=12)
+    result.stdout.fnmatch_lines(["*use --dist loadgroup*"])
+
+
+def test_shard(testdir):
+    testdir.makepyfile(HOSTS_TEST)
+    durations = dict(
+        ("docker://host%d" % i, [i + 1, 2]) for i in range(6))
+    testdir.makefile(".json", durations=json.dumps(durations))
+    for options in [[], ["--testinfra-shard-durations=durations.json"]]:
+        shards = []
+        for i in range(1, 4):
+            result = testdir.runpytest(
+                "--collect-only", "-q", "--testinfra-shard=%d/3" % i,
+                *options)
+            shards.append(set(
+                line.split("[")[1] for line in result.outlines
+                if "::test_a[" in line))
+        assert sorted(set.union(*shards)) == [
+            "docker://host%d]" % i for i in range(6)]
+        assert sum(len(s) for s in shards) == 6
+    # longest host first to the least loaded shard
+    assert shards == [
+        {"docker://host5]", "docker://host0]"},
+        {"docker://host4]", "docker://host1]"},
+        {"docker://host3]", "docker://host2]"},
+    ]
+
+
+def test_warmup(testdir):
+    testdir.makepyfile(test_warmup="""
+import time
+
+# not shared with other tests
+testinfra_hosts = ["local://?sudo=false"]
+
+
+def test_warm(TestinfraBackend):
+    SystemInfo = TestinfraBackend.get_module("SystemInfo")
+    for _ in range(100):
+        if SystemInfo._sysinfo is not None:
+            break
+        time.sleep(.1)
+    assert SystemInfo._sysinfo is not None
+""")
+    result = testdir.runpytest("--testinfra-warmup=2")
+    result.assert_outcomes(passed=1)
+
+
+def test_preflight(testdir):
+    testdir.makepyfile(test_preflight="""
+testinfra_hosts = ["local://", "docker://testinfra-missing-container"]
+
+
+def test_a(Command):
+    Command.check_output("true")
+
+test_b = test_a
+""")
+    result = testdir.runpytest("-v", "--testinfra-preflight=skip")
+    result.assert_outcomes(passed=2, skipped=2)
+    result.stdout.fnmatch_lines([
+        "*unreachable hosts*",
+        "docker://testinfra-missing-container: exit status *",
+    ])
+    result = testdir.runpytest("--testinfra-preflight=fail")
+    result.assert_outcomes(passed=2, errors=2)
+    result.stdout.fnmatch_lines([
+        "*docker://testinfra-missing-container unreachable (exit status*",
+    ])
+
+
+def test_workers_longest_first():
+    from testinfra.executor import ParallelExecutor
+    from testinfra.executor import _Host
+
+    class Durations(object):
+        durations = {"a": .1, "b": 3., "c": 1.}
+
+        def get_expected_duration(self, host, count):
+            return self.durations[host] * count
+
+    hosts = []
+    for key, count in (("a", 5), ("b", 1), ("c", 2), (None, 1)):
+        hosts.append(_Host(key))
+        hosts[-1].items.extend([None] * count)
+    hosts_queue = ParallelExecutor.get_queue(hosts, Durations())
+    keys = [hosts_queue.get_nowait().key for _ in hosts]
+    assert keys == ["b", "c", None, "a"]
+
+
+def test_facts_invalidate(testdir):
+    testdir.makepyfile(test_one="""
+import pytest
+
+testinfra_hosts = ["local://"]
+calls = []
+
+
+def test_a(TestinfraBackend):
+    assert TestinfraBackend.facts.get("x", calls.append, 1) is None
+    assert TestinfraBackend.facts.get("x", calls.append, 2) is None
+    assert calls == [1]
+
+
+@pytest.mark.testinfra_invalidate("x")
+def test_b(TestinfraBackend):
+    assert "x" in TestinfraBackend.facts
+
+
+def test_c(TestinfraBackend):
+    assert "x" not in TestinfraBackend.facts
+
+
+def test_d(TestinfraBackend, Command, tmpdir):
+    path = tmpdir.join("state").strpath
+    assert Command("echo 1 > %s", path).rc == 0
+    assert TestinfraBackend.facts.get(
+        "state", Command.check_output, "cat %s", path) == "1"
+    assert Command("echo 2 > %s", path).rc == 0
+    assert TestinfraBackend.facts.get(
+        "state", Command.check_output, "cat %s", path) == "2"
+
+
+# Commands reading the state of the host keep facts
+def test_e(TestinfraBackend, Command, Package):
+    TestinfraBackend.facts.get("y", calls.append, 3)
+    assert Command.check_output("echo ok") == "ok"
+    assert Command.exists("true")
+    Package("testinfra")
+    TestinfraBackend.facts.get("y", calls.append, 4)
+    assert calls == [1, 3]
+""")
+    result = testdir.runpytest("-p", "no:randomly")
+    result.assert_outcomes(passed=5)
+
+
+def test_select(testdir):
+    testdir.makepyfile(test_one="""
+import pytest
+
+testinfra_hosts = ["local://", "docker://host0"]
+pytestmark = pytest.mark.testinfra_select(
+    lambda host: host.Command.exists("true"))
+
+
+def test_a(TestinfraBackend):
+    assert TestinfraBackend.get_connection_type() == "local"
+
+
+@pytest.mark.testinfra_select(type=lambda t: t != "linux")
+def test_b(SystemInfo):
+    assert SystemInfo.type != "linux"
+
+
+@pytest.mark.testinfra_select(type=["linux", "openbsd"])
+def test_c(SystemInfo):
+    assert SystemInfo.type == "linux"
+""")
+    result = testdir.runpytest("-v", "-rs")
+    # docker is not found: no "true" command, and SystemInfo cannot be
+    # probed so the host is kept
+    result.stdout.fnmatch_lines([
+        "*test_a?local? PASSED*",
+        "*test_b?docker://host0? FAILED*",
+        "*test_c?local? PASSED*",
+        "*test_c?docker://host0? FAILED*",
+    ])
+    assert "test_a[docker://host0]" not in result.stdout.str()
+    assert "test_b[local]" not in result.stdout.str()
+
+
+def test_prefetch(testdir, monkeypatch):
+    import testinfra
+    testdir.makepyfile(test_one="""
+testinfra_hosts = ["local://"]
+
+
+def test_a(File):
+    assert File("/etc").is_directory
+
+
+# Commands run by modules to find their implementation don't discard results
+def test_b(Package, File):
+    assert Package("testinfra").name == "testinfra"
+    assert File("/etc/hosts").exists
+
+
+def test_c(File, Command):
+    assert File("/etc/passwd").exists != File("/nonexistent").exists
+    assert Command("true").rc == 0
+
+
+# Results prefetched before Command changes the host aren't used
+def test_d(File, Command):
+    Command("rm -f %s", PATH)
+    assert not File(PATH).exists
+    Command("touch %s", PATH)
+    assert File(PATH).exists
+""".replace("PATH", repr(testdir.tmpdir.join("x").strpath)))
+    result = testdir.runpytest("--testinfra-prefetch")
+    result.assert_outcomes(passed=4)
+    assert "testinfra prefetch" not in result.stdout.str()
+    # New backends, Package looks for its implementation again
+    monkeypatch.setattr(testinfra, "_BACKENDS_CACHE", {})
+    result = testdir.runpytest("--testinfra-prefetch")
+    result.assert_outcomes(passed=4)
+    result.stdout.fnmatch_lines([
+        "*testinfra prefetch: 5 commands prefetched, 4 used*"])
+
+
+def test_nagios_reporter():
+    from testinfra.main import NagiosReporter, _perfdata
+
+    class Backend(object):
+        command_count = 12
+        connect_time = 1.5
+        queue_time = 0.
+
+    reporter = NagiosReporter()
+    reporter.warning, reporter.critical = 10, 20
+    reporter.passed, reporter.total_time = 2, 5.
+    assert reporter.get_status() == ("OK", 0)
+    reporter.total_time = 15.
+    assert reporter.get_status() == ("WARNING", 1)
+    reporter.total_time = 25.
+    assert reporter.get_status() == ("CRITICAL", 2)
+    reporter.total_time = 1.
+    reporter.failed = 1
+    reporter.failures.append("test.py::test_b[local]")
+    assert reporter.get_status() == ("CRITICAL", 2)
+
+    assert _perfdata("it's a=b", 1.23456, "s", 10) == "'it''s a_b'=1.235s;10;"
+    assert _perfdata("passed", 3) == "'passed'=3"
+
+    reporter.durations["test.py::test_a[local]"] = 0.5
+    reporter.durations["test.py::test_b[local]"] = 0.25
+    reporter.backends["local"] = (Backend(), 2, 0.5, 0.)
+    reporter.host_items["local"].extend(reporter.durations)
+    # Host without finished test
+    reporter.backends["ssh://web"] = (Backend(), 0, 0., 0.)
+    ret, output = reporter.get_output()
+    assert ret == 2
+    assert output.splitlines() == [
+        "TESTINFRA CRITICAL - 2 passed, 1 failed, 0 skipped in 1.00 seconds "
+        "| 'time'=1.000s;10;20 'passed'=2 'failed'=1 'skipped'=0 "
+        "'slowest_test'=0.500s",
+        "FAILED test.py::test_b[local]",
+        "| 'local time'=0.750s",
+        "'local connect_time'=1.000s",
+        "'local queue_time'=0.000s",
+        "'local commands'=10",
+        "'local slowest_test'=0.500s",
+        "'ssh://web time'=0.000s",
+        "'ssh://web connect_time'=1.500s",
+        "'ssh://web queue_time'=0.000s",
+        "'ssh://web commands'=12",
+        "'ssh://web slowest_test'=0.000s",
+        "'test.py::test_a[local]'=0.500s",
+        "'test.py::test_b[local]'=0.250s",
+    ]
+
+
+def test_daemon(tmpdir):
+    import argparse
+    import time
+    from testinfra import daemon
+
+    assert daemon.parse_address("/run/t.sock") == ("unix", "/run/t.sock")
+    assert daemon.parse_address("unix:///run/t.sock") == (
+        "unix", "/run/t.sock")
+    assert daemon.parse_address("http://localhost:8080") == (
+        "http", ("localhost", 8080))
+    assert daemon.parse_address("http://:8080") == (
+        "http", ("127.0.0.1", 8080))
+    with pytest.raises(RuntimeError):
+        daemon.parse_address("tcp://localhost:8080")
+
+    address = "unix://" + tmpdir.join("daemon.sock").strpath
+    config = argparse.Namespace(option=argparse.Namespace(
+        daemon_interval=10, daemon_listen=address))
+    server = daemon.Daemon(config)
+    assert daemon.query(address)[0] == daemon.UNKNOWN
+    server.start_server()
+    try:
+        code, output = daemon.query(address)
+        assert code == daemon.UNKNOWN
+        assert output == "TESTINFRA UNKNOWN - no results yet\n"
+        server._result = {"code": 0, "output": "TESTINFRA OK\n",
+                          "time": time.time()}
+        assert daemon.query(address) == (0, "TESTINFRA OK\n")
+        server._result["time"] -= 31
+        code, output = daemon.query(address)
+        assert code == daemon.UNKNOWN
+        assert "results are stale" in output
+    finally:
+        server.stop_server()
+
+    config.option.daemon_listen = "http://127.0.0.1:0"
+    server = daemon.Daemon(config)
+    server._result = {"code": 0, "output": "TESTINFRA OK\n",
+                      "time": time.time()}
+    server.start_server()
+    try:
+        assert daemon.query("http://127.0.0.1:%d" % (
+            server.server.server_address[1],)) == (0, "TESTINFRA OK\n")
+    finally:
+        server.stop_server()
+
+
+def test_daemon_workers(testdir):
+    testdir.makepyfile("""
+def test_a():
+    pass
+""")
+    for option in ("--testinfra-workers=2", "--testinfra-adaptive"):
+        result = testdir.runpytest(
+            "--daemon", "--daemon-listen=http://127.0.0.1:0", option)
+        assert result.ret == 4
+        result.stderr.fnmatch_lines([
+            "*--daemon cannot be used with --testinfra-workers*"])
+
+
+def test_history(testdir, monkeypatch, capsys):
+    import sqlite3
+    from testinfra import history
+    monkeypatch.setattr(history, "BATCH_SIZE", 2)
+    flushes = []
+    flush = history.HistoryStore.flush
+    monkeypatch.setattr(history.HistoryStore, "flush", lambda self: (
+        flushes.append(len(self.pending_tests)), flush(self)))
+    testdir.makepyfile(test_one="""
+testinfra_hosts = ["local://"]
+
+
+def test_a(Command):
+    Command.check_output("echo a")
+
+
+def test_b(Command):
+    Command.check_output("echo b")
+
+
+def test_c(Command):
+    assert Command("echo c").rc == 1
+""")
+    path = testdir.tmpdir.join("history.sqlite").strpath
+    for _ in range(2):
+        result = testdir.runpytest("--history-db=" + path)
+        result.assert_outcomes(passed=2, failed=1)
+    # Written by batches during the session and at the end
+    assert flushes == [2, 1, 2, 1]
+    db = sqlite3.connect(path)
+    assert db.execute(
+        "SELECT id, passed, failed, skipped FROM sessions").fetchall() == [
+            (1, 2, 1, 0), (2, 2, 1, 0)]
+    assert db.execute(
+        "SELECT nodeid, host, outcome FROM tests WHERE session_id = 2 "
+        "ORDER BY nodeid").fetchall() == [
+            ("test_one.py::test_a[local]", "local", "passed"),
+            ("test_one.py::test_b[local]", "local", "passed"),
+            ("test_one.py::test_c[local]", "local", "failed")]
+    assert db.execute(
+        "SELECT nodeid, command, exit_status FROM commands "
+        "WHERE session_id = 2 AND command LIKE 'echo %' "
+        "ORDER BY nodeid").fetchall() == [
+            ("test_one.py::test_a[local]", "echo a", 0),
+            ("test_one.py::test_b[local]", "echo b", 0),
+            ("test_one.py::test_c[local]", "echo c", 0)]
+    assert db.execute("SELECT host FROM hosts").fetchall() == [
+        ("local",), ("local",)]
+    db.close()
+
+    capsys.readouterr()
+    assert history.main([path, "sessions"]) == 0
+    lines = capsys.readouterr()[0].splitlines()
+    assert lines[0].split() == [
+        "id", "start", "duration", "passed", "failed", "skipped"]
+    assert [line.split()[0] for line in lines[1:]] == ["2", "1"]
+    assert history.main([path, "trend", "--command", "echo a"]) == 0
+    lines = capsys.readouterr()[0].splitlines()
+    assert [line.split()[:3] for line in lines] == [
+        ["session", "host", "count"], ["1", "local", "1"],
+        ["2", "local", "1"]]
+    assert history.main([
+        path, "regressions", "--factor", "0", "--min-duration", "0"]) == 1
+    lines = capsys.readouterr()[0].splitlines()
+    assert lines[0] == "Comparing session 2 to session 1"
+    assert "test_one.py::test_a[local]" in "\n".join(lines)
+    assert history.main([path, "regressions", "--factor", "1000"]) == 0
+
+
+def test_incremental(testdir, monkeypatch):
+    from testinfra import incremental
+    fingerprint = testdir.tmpdir.join("fingerprint")
+    fingerprint.write("1")
+    monkeypatch.setattr(
+        incremental, "FINGERPRINT_COMMAND", "cat " + fingerprint.strpath)
+    test = """
+testinfra_hosts = ["local://"]
+
+
+def test_a(Command):
+    assert Command("true").rc == 0
+
+
+def test_b(Command):
+    assert Command("false").rc == 0
+"""
+    testdir.makepyfile(test_one=test)
+    testdir.runpytest("--incremental").assert_outcomes(passed=1, failed=1)
+    # Failed tests run again
+    testdir.runpytest("--incremental").assert_outcomes(skipped=1, failed=1)
+    fingerprint.write("2")
+    testdir.runpytest("--incremental").assert_outcomes(passed=1, failed=1)
+    testdir.runpytest("--incremental").assert_outcomes(skipped=1, failed=1)
+    testdir.makepyfile(test_one=test + "\n# changed\n")
+    testdir.runpytest("--incremental").assert_outcomes(passed=1, failed=1)
+    testdir.runpytest("--incremental").assert_outcomes(skipped=1, failed=1)
+
+
+def test_incremental_concurrency():
+    import threading
+    import time
+    from testinfra import incremental
+    lock = threading.Lock()
+    running = [0, 0]
+
+    class Backend(object):
+
+        def __init__(self, name):
+            self.name = name
+
+        def get_pytest_id(self):
+            return self.name
+
+        def run(self, command):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(.1)
+            with lock:
+                running[0] -= 1
+            if self.name == "down":
+                raise RuntimeError("unreachable")
+            return type(str("Out"), (object,), {
+                "stdout": self.name, "stdout_bytes": self.name.encode()})
+
+    fingerprints = incremental.get_fingerprints(
+        [Backend("h%d" % i) for i in range(9)] + [Backend("down")],
+        concurrency=5)
+    assert sorted(fingerprints) == ["down"] + ["h%d" % i for i in range(9)]
+    assert fingerprints["down"] is None
+    assert len(set(fingerprints.values())) == 10
+    # bounded by concurrency
+    assert running[1] == 5
+
+
+def test_workers_history(testdir, monkeypatch):
+    import sqlite3
+    from testinfra import history
+    monkeypatch.setattr(history, "BATCH_SIZE", 2)
+    testdir.makepyfile(HOSTS_TEST)
+    path = testdir.tmpdir.join("history.sqlite").strpath
+    result = testdir.runpytest("--history-db=" + path, "--testinfra-workers=2")
+    result.assert_outcomes(passed=11, failed=1)
+    db = sqlite3.connect(path)
+    assert db.execute(
+        "SELECT outcome, COUNT(DISTINCT host), COUNT(*) FROM tests "
+        "GROUP BY outcome ORDER BY outcome").fetchall() == [
+            ("failed", 1, 1), ("passed", 6, 11)]
+    db.close()
+
+
+def test_workers_fixtures(testdir):
+    from testinfra import executor
+    testdir.makeconftest("""
+import pytest
+
+SETUPS = []
+
+
+@pytest.fixture(scope="session")
+def session_fixture():
+    SETUPS.append(None)
+""")
+    testdir.makepyfile("""
+import conftest
+
+testinfra_hosts = ["docker://host%d" % i for i in range(4)]
+
+
+def test_a(TestinfraBackend, session_fixture):
+    # Once per thread
+    assert len(conftest.SETUPS) <= 2
+
+
+def test_b(TestinfraBackend, session_fixture):
+    assert len(conftest.SETUPS) <= 2
+""")
+    result = testdir.runpytest("--testinfra-workers=2")
+    result.assert_outcomes(passed=8)
+    assert not isinstance(
+        executor.FixtureDef.__dict__.get("cached_result"),
+        executor._ThreadLocalAttribute)
+
+
+def test_workers_capture(testdir):
+    testdir.makepyfile("""
+import logging
+import time
+import warnings
+
+testinfra_hosts = ["docker://h%d" % i for i in range(6)]
+
+
+def test_a(TestinfraBackend):
+    name = TestinfraBackend.get_hostname()
+    for i in range(5):
+        print("OUT-%s-%d" % (name, i))
+        logging.getLogger("test").warning("LOG-%s-%d", name, i)
+        warnings.warn(UserWarning("W-%s-%d" % (name, i)))
+        time.sleep(.01)
+    assert 0
+""")
+    result = testdir.runpytest("--testinfra-workers=4")
+    result.assert_outcomes(failed=6)
+    reports = [
+        r for r in result.reprec.getreports("pytest_runtest_logreport")
+        if r.when == "call"]
+    assert len(reports) == 6
+    for report in reports:
+        name = report.nodeid.split("docker://")[1].rstrip("]")
+        sections = dict(report.sections)
+        assert sections["Captured stdout call"].split() == [
+            "OUT-%s-%d" % (name, i) for i in range(5)]
+        assert sections["Captured log call"].count("LOG-") == 5
+        assert sections["Captured log call"].count("LOG-%s-" % (name,)) == 5
+    warned = [
+        (call.nodeid, str(call.warning_message.message))
+        for call in result.reprec.getcalls("pytest_warning_recorded")]
+    assert len(warned) == 30
+    for nodeid, message in warned:
+        assert message.startswith("W-" + nodeid.split("docker://")[1][:-1])
+    # Output isn't written outside of reports of tests
+    assert result.stdout.str().count("OUT-h3-4") == 1
@@ -0,0 +1,242 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Coroutines used by the asyncio API (python >= 3.5 only)
+
+Backends and modules must stay importable with python 2, so they only
+import this module from their async methods.
+"""
+
+from __future__ import unicode_literals
+
+import asyncio
+import functools
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from testinfra.backend import base
+from testinfra.modules.base import CommandNeeded
+
+# Event loop shared by backends needing a running loop (see asyncssh backend)
+_LOOP = None
+_LOOP_LOCK = threading.Lock()
+# Bound the number of connections being established
+_CONNECTING = None
+
+
+async def run_in_executor(func, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(func, *args, **kwargs))
+
+
+async def then(awaitable, func):
+    """Return func(await awaitable)"""
+    return func(await awaitable)
+
+
+async def run_local(backend, command, *args, timeout=None):
+    command = backend.encode(backend.quote(command, *args))
+    if not (backend.max_commands or backend.command_rate):
+        return await _run_local(backend, command, timeout)
+    # Semaphores of HostLimits are shared with threads
+    await run_in_executor(base.limits.acquire, backend)
+    try:
+        return await _run_local(backend, command, timeout)
+    finally:
+        base.limits.release(backend)
+
+
+async def _run_local(backend, command, timeout):
+    start = time.time()
+    proc = await asyncio.create_subprocess_shell(
+        command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=timeout is not None,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        await proc.wait()
+        backend._record_command(command, start, None)
+        return backend.result(None, command, b"", b"", timed_out=True)
+    backend._record_command(command, start, proc.returncode)
+    return backend.result(proc.returncode, command, stdout, stderr)
+
+
+async def evaluate(backend, func, *args, **kwargs):
+    """Call func and await the commands it runs through modules
+
+    Modules raise CommandNeeded for commands without a result yet, the
+    command is awaited and func is called again (so it must not have side
+    effects besides running commands) until it returns.
+    """
+    results = {}
+    while True:
+        backend._local.results = results
+        try:
+            return func(*args, **kwargs)
+        except CommandNeeded as exc:
+            command, cmd_args, cmd_kwargs = exc.args
+        finally:
+            backend._local.results = None
+        results[(command, cmd_args)] = await backend.arun(
+            command, *cmd_args, **cmd_kwargs)
+
+
+def get_loop():
+    """Return the shared event loop, running in a daemon thread"""
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=loop.run_forever, name="testinfra-event-loop")
+            thread.daemon = True
+            thread.start()
+            _LOOP = loop
+    return _LOOP
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def run_in_loop(awaitable):
+    """Run awaitable in the shared loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(
+        _await(awaitable), get_loop()).result()
+
+
+async def await_in_loop(coro):
+    """Await coro running in the shared loop from any event loop"""
+    loop = get_loop()
+    if asyncio.get_event_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(
+        asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+async def _asyncssh_connect(backend):
+    import asyncssh
+    global _CONNECTING
+    if _CONNECTING is None:
+        _CONNECTING = asyncio.Semaphore(
+            base.limits.max_connecting or backend.MAX_CONNECTING)
+    options = {}
+    if backend.user:
+        options["username"] = backend.user
+    if backend.port:
+        options["port"] = int(backend.port)
+    if backend.ssh_config:
+        options["config"] = [os.path.expanduser(backend.ssh_config)]
+    async with _CONNECTING:
+        start = time.time()
+        connection = await asyncssh.connect(backend.host, **options)
+        with backend._lock:
+            backend.connect_time += time.time() - start
+    # Sessions also bound concurrent commands of the host (max_commands)
+    return connection, asyncio.Semaphore(
+        min(backend.MAX_SESSIONS, backend.max_commands or float("inf")))
+
+
+async def _asyncssh_connection(backend):
+    # Concurrent commands wait for the same connection
+    future = backend._connection
+    if future is None:
+        future = backend._connection = asyncio.ensure_future(
+            _asyncssh_connect(backend))
+    try:
+        return await asyncio.shield(future)
+    except Exception:
+        if backend._connection is future:
+            backend._connection = None
+        raise
+
+
+async def asyncssh_run(backend, command, timeout=None):
+    import asyncssh
+    command = backend.encode(command)
+    with base.connections.use(backend):
+        for retry in (True, False):
+            connection, sessions = await _asyncssh_connection(backend)
+            queued = time.time() if sessions.locked() else None
+            async with sessions:
+                delay = base.limits.reserve(backend)
+                if delay:
+                    queued = queued or time.time()
+                    await asyncio.sleep(delay)
+                start = time.time()
+                if queued is not None:
+                    base.limits.record(backend, start - queued)
+                try:
+                    process = await connection.create_process(
+                        command, encoding=None)
+                    try:
+                        out = await asyncio.wait_for(process.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        # The remote command is killed by the timeout
+                        # wrapper of get_timeout_command()
+                        process.close()
+                        backend._record_command(command, start, None)
+                        return backend.result(
+                            None, command, b"", b"", timed_out=True)
+                except asyncssh.DisconnectError:
+                    if not retry:
+                        raise
+                    # try to reinit connection (once)
+                    if backend._connection is not None and (
+                        backend._connection.done() and
+                        backend._connection.result()[0] is connection
+                    ):
+                        backend._connection = None
+                    continue
+            backend._record_command(command, start, out.exit_status)
+            return backend.result(
+                out.exit_status, command, out.stdout, out.stderr)
+
+
+def asyncssh_close(future):
+    """Close the connection of a future returned by _asyncssh_connect()"""
+    asyncio.run_coroutine_threadsafe(_asyncssh_close(future), get_loop())
+
+
+async def _asyncssh_close(future):
+    try:
+        connection, _ = await future
+    except Exception:  # pylint: disable=broad-except
+        return
+    connection.close()
+
+
+async def asyncssh_run_process(process):
+    """asyncssh server process factory running the command in a local shell
+
+    Used to test the asyncssh backend against a local server.
+    """
+    proc = await asyncio.create_subprocess_shell(
+        process.command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await proc.communicate()
+    process.stdout.write(stdout)
+    process.stderr.write(stderr)
+    process.exit(proc.returncode)
@@ -0,0 +1,76 @@
+# coding: utf-8
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Connect to hosts and discover their facts in background threads
+
+Backends are queued as soon as tests are parametrized with them, so the
+warm-up overlaps with the collection and tests start with ready connections.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+import weakref
+
+from six.moves import queue
+
+logger = logging.getLogger("testinfra")
+
+
+def warmup(backend):
+    """Open the connection and discover SystemInfo facts"""
+    start = time.time()
+    try:
+        backend.get_module("SystemInfo").sysinfo
+    except Exception as exc:  # pylint: disable=broad-except
+        # Tests using the backend will report the error
+        logger.debug("Warm-up of %s failed: %s", backend.get_pytest_id(), exc)
+    else:
+        logger.debug(
+            "Warm-up of %s done in %.3f seconds", backend.get_pytest_id(),
+            time.time() - start)
+
+
+class Warmup(object):
+    """pytest plugin warming up backends with bounded concurrency"""
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.queue = queue.Queue()
+        self.threads = []
+        self.seen = weakref.WeakSet()
+        super(Warmup, self).__init__()
+
+    def _worker(self):
+        while True:
+            backend = self.queue.get()
+            if backend is None:
+                return
+            warmup(backend)
+
+    def submit(self, backends):
+        for backend in backends:
+            if backend is None or backend in self.seen:
+                continue
+            self.seen.add(backend)
+            if len(self.threads) < self.concurrency:
+                thread = threading.Thread(target=self._worker)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+            self.queue.put(backend)
+
+    def pytest_sessionfinish(self):
+        for _ in self.threads:
+            self.queue.put(None)